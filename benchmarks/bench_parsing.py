@@ -0,0 +1,95 @@
+"""
+Benchmark del parseo: BeautifulSoup/html.parser vs lxml en streaming.
+
+Uso:
+    python benchmarks/bench_parsing.py carpeta_con_html/ [--repeat 5]
+
+Para cada página guardada (*.html / *.htm) comprueba que los dos modos de
+parsear_dom() producen exactamente el mismo dict de features (con y sin
+eliminación de boilerplate) y mide el tiempo medio de cada uno. Antes comprueba
+lo mismo con una serie de casos de marcado mal formado.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seo_core import parsear_dom  # noqa: E402
+
+MODOS = ["html.parser", "lxml"]
+
+# Marcado roto que libxml2 y html.parser reparan de forma distinta
+CASOS_MALFORMADOS = {
+    "title sin cerrar": "<title>Mi título<meta name='description' content='d'></head><body><h1>Uno</h1><h2>Dos</h2>",
+    "marcado en el title": "<title>A <b>B</b></title></head><body><p>x</p>",
+    "h1 sin cerrar": "<title>T</title></head><body><h1>Titular <p>párrafo</p><h2>Sub</h2>",
+    "b que cruza párrafos": "<title>T</title></head><body><p>a <b>uno</p><p>dos</b> tres</p>",
+    "bloque dentro de b": "<title>T</title></head><body><b>uno <p>dos</p> tres</b>",
+    "bloque dentro de h2": "<title>T</title></head><body><h2>a <p>b</p> c</h2>",
+    "strong anidado": "<title>T</title></head><body><p><strong>fuera <strong>dentro</strong> cola</strong></p>",
+    "b anidado sin cerrar": "<title>T</title></head><body><b>uno <b>dos</b>",
+}
+
+
+def diferencias_features(html, nombre):
+    """Número de modos de boilerplate (0-2) en que lxml no da lo mismo que html.parser"""
+    diferencias = 0
+    for quitar in (False, True):
+        referencia = parsear_dom(html, quitar, "html.parser")
+        rapido = parsear_dom(html, quitar, "lxml")
+        if referencia != rapido:
+            diferencias += 1
+            claves = [k for k in referencia if referencia[k] != rapido.get(k)]
+            print(f"  ⚠️ {nombre} (boilerplate={quitar}) difiere en: {', '.join(claves)}")
+    return diferencias
+
+
+def medir(html, modo, quitar_boilerplate, repeat):
+    inicio = time.perf_counter()
+    for _ in range(repeat):
+        parsear_dom(html, quitar_boilerplate, modo)
+    return (time.perf_counter() - inicio) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Carpeta con páginas HTML guardadas")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por página y modo")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.corpus, "*.htm*")))
+    if not paths:
+        sys.exit(f"No hay ficheros .html en {args.corpus}")
+
+    diferencias = sum(diferencias_features(f"<html><head>{html}</body></html>".encode(), nombre)
+                      for nombre, html in CASOS_MALFORMADOS.items())
+    print(f"Casos mal formados con features distintos: {diferencias}")
+
+    totales = {modo: 0.0 for modo in MODOS}
+    print(f"{'página':40} {'KB':>7} {'html.parser':>12} {'lxml':>9} {'x':>6}")
+    for path in paths:
+        with open(path, "rb") as f:
+            html = f.read()
+
+        diferencias += diferencias_features(html, os.path.basename(path))
+
+        tiempos = {modo: medir(html, modo, True, args.repeat) for modo in MODOS}
+        for modo in MODOS:
+            totales[modo] += tiempos[modo]
+        print(f"{os.path.basename(path)[:40]:40} {len(html) / 1024:7.0f} "
+              f"{tiempos['html.parser'] * 1000:10.1f}ms {tiempos['lxml'] * 1000:7.1f}ms "
+              f"{tiempos['html.parser'] / tiempos['lxml']:5.1f}x")
+
+    print("-" * 78)
+    print(f"{'TOTAL (' + str(len(paths)) + ' páginas)':40} {'':7} "
+          f"{totales['html.parser'] * 1000:10.1f}ms {totales['lxml'] * 1000:7.1f}ms "
+          f"{totales['html.parser'] / totales['lxml']:5.1f}x")
+    print(f"Páginas con features distintos: {diferencias}")
+    sys.exit(1 if diferencias else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark del arranque en frío.
+
+Uso:
+    python benchmarks/bench_startup.py [--repeat 5]
+
+Mide, cada vez en un proceso Python nuevo:
+  * el coste de importar cada dependencia por separado,
+  * el de importar seo_core (y qué dependencias pesadas arrastra),
+  * el tiempo hasta el primer render de la app (AppTest de Streamlit, sin analizar nada).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEPENDENCIAS = [
+    "streamlit", "requests", "bs4", "lxml.etree", "numpy", "pandas",
+    "trafilatura", "sklearn.feature_extraction.text", "sklearn.cluster",
+]
+PESADAS = ["numpy", "pandas", "trafilatura", "sklearn"]
+
+IMPORTAR = """
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+print(json.dumps({{"segundos": time.perf_counter() - inicio,
+                  "pesadas": [m for m in {pesadas!r} if m in sys.modules]}}))
+"""
+
+PRIMER_RENDER = """
+import json, sys, time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+antes = set(sys.modules)
+at = AppTest.from_file({script!r}, default_timeout=120)
+at.secrets["SERPER_API_KEY"] = "bench"
+at.run()
+print(json.dumps({{"segundos": time.perf_counter() - inicio,
+                  "errores": [str(e.message) for e in at.exception],
+                  "pesadas": [m for m in {pesadas!r} if m in sys.modules and m not in antes]}}))
+"""
+
+
+def ejecutar(codigo):
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, capture_output=True, text=True)
+    if salida.returncode != 0:
+        raise RuntimeError(salida.stderr.strip().splitlines()[-1] if salida.stderr else "error")
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def medir(codigo, repeat):
+    resultados = [ejecutar(codigo) for _ in range(repeat)]
+    return statistics.median(r["segundos"] for r in resultados), resultados[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Procesos nuevos por medición (se da la mediana)")
+    args = parser.parse_args()
+
+    print(f"{'import':40} {'mediana':>10}")
+    for modulo in DEPENDENCIAS:
+        try:
+            segundos, _ = medir(IMPORTAR.format(modulo=modulo, pesadas=PESADAS), args.repeat)
+            print(f"{modulo:40} {segundos * 1000:8.0f}ms")
+        except RuntimeError as e:
+            print(f"{modulo:40} {'no disponible':>10} ({e})")
+
+    print("-" * 52)
+    segundos, ultimo = medir(IMPORTAR.format(modulo="seo_core", pesadas=PESADAS), args.repeat)
+    print(f"{'seo_core':40} {segundos * 1000:8.0f}ms  pesadas cargadas: {', '.join(ultimo['pesadas']) or '-'}")
+
+    script = os.path.join(RAIZ, "seo_tool_ultra.py")
+    segundos, ultimo = medir(PRIMER_RENDER.format(script=script, pesadas=PESADAS), args.repeat)
+    print(f"{'primer render (seo_tool_ultra.py)':40} {segundos * 1000:8.0f}ms  "
+          f"pesadas cargadas: {', '.join(ultimo['pesadas']) or '-'}")
+    if ultimo["errores"]:
+        print(f"  ⚠️ la app lanzó: {ultimo['errores']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
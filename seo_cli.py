@@ -0,0 +1,132 @@
+"""
+SERP X-RAY 360™ - línea de comandos (sin Streamlit).
+
+Uso:
+    python seo_cli.py keyword "que es el repep" [--variante repep] [--json salida.json] [--informe]
+    python seo_cli.py lote keywords.txt [--salida carpeta/] [--paralelo 4] [--no-reanudar]
+    python seo_cli.py mercados "que es el repep" --mercado es-es --mercado mx-es [--json comparativa.json]
+
+La API key de Serper se lee de la variable de entorno SERPER_API_KEY.
+"""
+import argparse
+import sys
+import time
+
+import seo_core
+
+
+def cmd_keyword(args):
+    salida = seo_core.analizar_keyword(args.keyword, args.competidores, max_workers=args.conexiones,
+                                       gl=args.gl, hl=args.hl, variantes=args.variante)
+    if salida['estado'] != "ok":
+        print(f"❌ {args.keyword}: {salida['estado']}", file=sys.stderr)
+        return 1
+
+    print(f"{'Pos':>3} {'Score':>5}  {'Palabras':>8} {'H2':>3}  URL")
+    for fila in salida['competidores']:
+        print(f"{fila['Pos']:>3} {fila['Score']:>5}  {fila['Palabras']:>8} {fila['Num_H2s']:>3}  {fila['URL']}")
+
+    bench = salida['gap_analysis']['coverage_benchmark']
+    print(f"\n📊 Promedios: {bench['word_avg']:.0f} palabras · {bench['h2_avg']:.1f} H2 · "
+          f"{bench['internal_links_avg']:.1f} links int. · {bench['media_avg']:.1f} media")
+
+    if args.informe:
+        print(seo_core.construir_gap_report(salida['gap_analysis'], args.keyword, len(salida['competidores'])))
+    if args.json:
+        seo_core.guardar_json(salida, args.json)
+        print(f"💾 {args.json}")
+    return 0
+
+
+def cmd_lote(args):
+    with open(args.fichero, "rb") as f:
+        keywords = seo_core.leer_keywords(f.read(), args.fichero)
+    if not keywords:
+        print(f"❌ No hay keywords en {args.fichero}", file=sys.stderr)
+        return 1
+
+    inicio = time.time()
+
+    def on_keyword(r, hechas, total):
+        print(f"[{hechas}/{total}] {r['keyword']}: {r['estado']} ({time.time() - inicio:.0f}s)", flush=True)
+
+    resumen = seo_core.analizar_lote(keywords, args.competidores, out_dir=args.salida,
+                                     max_conexiones=args.conexiones, keywords_paralelo=args.paralelo,
+                                     reanudar=args.reanudar, on_keyword=on_keyword)
+    errores = sum(1 for r in resumen if r['estado'] not in ("ok", "ya exportada"))
+    print(f"✅ {len(resumen) - errores}/{len(resumen)} keywords en {args.salida} ({time.time() - inicio:.0f}s)")
+    return 1 if errores else 0
+
+
+def cmd_mercados(args):
+    mercados = args.mercado or list(seo_core.MERCADOS)
+    inicio = time.time()
+
+    def on_mercado(mercado, salida):
+        print(f"{seo_core.MERCADOS[mercado][2]}: {salida['estado']} ({time.time() - inicio:.0f}s)", flush=True)
+
+    salidas = seo_core.analizar_mercados(args.keyword, mercados, args.competidores, args.conexiones,
+                                         variantes=args.variante, on_mercado=on_mercado)
+    comparativa = seo_core.comparar_mercados(salidas)
+
+    print("\n" + " ".join(f"{m:>6}" for m in mercados) + "  URL")
+    for fila in comparativa['posiciones']:
+        print(" ".join(f"{fila[m] if fila[m] is not None else '—':>6}" for m in mercados) + f"  {fila['URL']}")
+    print(f"\n🤝 Compartidas por todos: {len(comparativa['compartidas'])}")
+    for m, urls in comparativa['exclusivas'].items():
+        print(f"📍 Solo en {seo_core.MERCADOS[m][2]}: {len(urls)}")
+
+    for m, bench in comparativa['benchmarks'].items():
+        dif = comparativa['diferencias'].get(m)
+        extra = f" ({dif['word_avg']:+.0f}% palabras vs {mercados[0]})" if dif else ""
+        print(f"📊 {m}: {bench['word_avg']:.0f} palabras · {bench['h2_avg']:.1f} H2 · "
+              f"{bench['internal_links_avg']:.1f} links int.{extra}")
+    if comparativa['h2s_compartidos']:
+        print(f"🔥 H2 críticos en todos los mercados: {', '.join(comparativa['h2s_compartidos'])}")
+
+    if args.json:
+        seo_core.guardar_json({"keyword": args.keyword, "comparativa": comparativa, "mercados": salidas}, args.json)
+        print(f"💾 {args.json}")
+    return 1 if all(s['estado'] != "ok" for s in salidas.values()) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--competidores", type=int, default=5, help="Competidores válidos por keyword")
+    parser.add_argument("--conexiones", type=int, default=seo_core.MAX_CONEXIONES, help="Descargas simultáneas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_kw = sub.add_parser("keyword", help="Analiza una keyword")
+    p_kw.add_argument("keyword")
+    p_kw.add_argument("--gl", default="es", help="País de la SERP")
+    p_kw.add_argument("--hl", default="es", help="Idioma de la SERP")
+    p_kw.add_argument("--variante", action="append", default=[],
+                      help="Variante que cuenta como mención de la keyword (repetible)")
+    p_kw.add_argument("--json", help="Guarda el resultado completo en este fichero")
+    p_kw.add_argument("--informe", action="store_true", help="Imprime el informe Gap Analysis")
+    p_kw.set_defaults(func=cmd_keyword)
+
+    p_lote = sub.add_parser("lote", help="Analiza un TXT/CSV de keywords (un JSON por keyword)")
+    p_lote.add_argument("fichero")
+    p_lote.add_argument("--salida", default=seo_core.LOTE_DIR, help="Carpeta de resultados")
+    p_lote.add_argument("--paralelo", type=int, default=seo_core.LOTE_KEYWORDS_PARALELO,
+                        help="Keywords analizándose a la vez")
+    p_lote.add_argument("--no-reanudar", dest="reanudar", action="store_false",
+                        help="Vuelve a analizar keywords ya exportadas")
+    p_lote.set_defaults(func=cmd_lote)
+
+    p_mer = sub.add_parser("mercados", help="Compara la misma keyword en varios mercados (gl, hl)")
+    p_mer.add_argument("keyword")
+    p_mer.add_argument("--mercado", action="append", choices=list(seo_core.MERCADOS),
+                       help="Mercado a analizar (repetible; el primero es la referencia). Por defecto, todos")
+    p_mer.add_argument("--variante", action="append", default=[],
+                       help="Variante que cuenta como mención de la keyword (repetible)")
+    p_mer.add_argument("--json", help="Guarda la comparativa y los resultados por mercado en este fichero")
+    p_mer.set_defaults(func=cmd_mercados)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
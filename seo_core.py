@@ -0,0 +1,2325 @@
+"""
+SERP X-RAY 360™ - núcleo sin interfaz.
+
+SERP, descarga y análisis de competidores, score card, gap analysis, clustering
+y modo lote. No importa streamlit: lo usan la app (seo_tool_ultra.py), la CLI
+(seo_cli.py), los benchmarks y cualquier script o worker.
+"""
+import requests
+from bs4 import BeautifulSoup, Tag
+from bs4.dammit import UnicodeDammit
+try:
+    from lxml import etree
+except ImportError:  # sin lxml: se usa siempre html.parser
+    etree = None
+import re
+from collections import Counter, deque
+import urllib3
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
+from datetime import datetime
+import json
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
+import time
+import os
+import sqlite3
+try:
+    import fcntl
+except ImportError:  # Windows: el lock entre procesos se limita al proceso actual
+    fcntl = None
+import threading
+import functools
+import importlib
+import hashlib
+import zlib
+import unicodedata
+import sys
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# ==========================================
+# 💤 DEPENDENCIAS PESADAS (IMPORTACIÓN DIFERIDA)
+# ==========================================
+class ModuloPerezoso:
+    """Importa el módulo la primera vez que se usa uno de sus atributos"""
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+    
+    def __getattr__(self, attr):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, attr)
+
+# numpy/pandas/trafilatura solo se cargan al analizar; scikit-learn, dentro de las
+# funciones que lo usan
+np = ModuloPerezoso("numpy")
+pd = ModuloPerezoso("pandas")
+trafilatura = ModuloPerezoso("trafilatura")
+
+# ==========================================
+# 🔑 API KEYS & CONFIGURACIÓN
+# ==========================================
+# La app de Streamlit la sustituye por la de st.secrets si existe
+SERPER_API_KEY = os.environ.get("SERPER_API_KEY", "cb2f958314203c51f8835f854b6a5038df46fb11")
+
+DOMINIOS_EXCLUIDOS = [
+    "youtube.com", "facebook.com", "instagram.com", "twitter.com", 
+    "tiktok.com", "pinterest", "linkedin", "amazon", "ebay"
+]
+
+H2_BLACKLIST = [
+    "suscríbete", "newsletter", "contacto", "ayuda", "política", "privacidad", 
+    "cookies", "menú", "login", "carrito"
+]
+
+FAQ_BLACKLIST = ["cookie", "política", "privacidad", "suscripción"]
+
+STOPWORDS = set([
+    "de", "la", "que", "el", "en", "y", "a", "los", "se", "del", "las", "un", 
+    "por", "con", "no", "una", "su", "para", "es", "al", "lo", "como", "mas", "más"
+])
+
+# Descargas simultáneas por defecto al analizar competidores
+MAX_CONEXIONES = 6
+
+# Red: timeouts (conexión, lectura), pool por host y reintentos ante 429/503
+HTTP_TIMEOUT = (5, 12)
+HTTP_POOL_HOSTS = 32
+HTTP_POOL_POR_HOST = 4
+HTTP_REINTENTOS = 3
+MAX_RETRY_AFTER = 20
+
+# Caché en disco de páginas descargadas
+CACHE_DIR = os.environ.get("SEO_XRAY_CACHE_DIR", ".seo_xray_cache")
+PAGE_CACHE_TTL = int(os.environ.get("SEO_XRAY_PAGE_TTL", 24 * 3600))  # segundos
+PAGE_CACHE_MAX_MB = int(os.environ.get("SEO_XRAY_PAGE_CACHE_MB", 500))
+PARAMS_TRACKING = ("utm_", "gclid", "fbclid", "mc_cid", "mc_eid")
+
+# Caché de respuestas de Serper
+SERP_CACHE_TTL = int(os.environ.get("SEO_XRAY_SERP_TTL", 12 * 3600))  # segundos
+
+# Paginación de la SERP: resultados por página, profundidad máxima y tasa de descargas
+# fallidas que se supone antes de haber observado ninguna
+SERP_PAGINA = 10
+SERP_MAX_PAGINAS = 10
+SERP_TASA_FALLO_INICIAL = 0.3
+
+# Subir al cambiar cualquier analizador: invalida la caché de análisis
+ANALYZER_VERSION = "6"
+
+# Parser del DOM: "lxml" (streaming, rápido) o "html.parser" (BeautifulSoup)
+PARSER_MODE = os.environ.get("SEO_XRAY_PARSER", "lxml")
+
+# Subárboles que no son contenido (se descartan si trafilatura no extrae texto)
+BOILERPLATE_TAGS = ["script", "style", "nav", "footer", "header", "aside", "form"]
+
+# Clustering temático: k máximo, documentos para elegir k (silhouette), tamaño de lote,
+# features del espacio donde se agrupa (más estrecho que el de la IDF) y documentos
+# hasta los que la búsqueda de k usa KMeans exacto en vez de MiniBatchKMeans
+CLUSTER_K_MAX = 8
+CLUSTER_MUESTRA_SILHOUETTE = 2000
+CLUSTER_LOTE = 256
+CLUSTER_N_FEATURES = 2 ** 14
+CLUSTER_KMEANS_MAX_DOCS = 500
+
+# Agrupación de H2 casi iguales: MinHash (permutaciones), bandas LSH y Jaccard mínimo
+# entre 3-gramas de caracteres para proponer candidatos, y proporción mínima de palabras
+# equivalentes para confirmarlos
+H2_MINHASH_PERMUTACIONES = 64
+H2_LSH_BANDAS = 16
+H2_JACCARD_MIN = 0.6
+H2_PALABRAS_MIN = 0.6
+
+# Modo lote: carpeta de resultados (un JSON por keyword) y keywords en paralelo
+LOTE_DIR = os.environ.get("SEO_XRAY_LOTE_DIR", "seo_xray_lotes")
+LOTE_KEYWORDS_PARALELO = 4
+MAPA_TEMATICO = "mapa_tematico.json"
+
+# Mercados para el modo multi-mercado: clave -> (gl, hl, etiqueta)
+MERCADOS = {
+    "es-es": ("es", "es", "🇪🇸 España"),
+    "mx-es": ("mx", "es", "🇲🇽 México"),
+    "ar-es": ("ar", "es", "🇦🇷 Argentina"),
+    "co-es": ("co", "es", "🇨🇴 Colombia"),
+}
+
+# ==========================================
+# 🔒 RECURSOS COMPARTIDOS (SINGLETONS PEREZOSOS)
+# ==========================================
+def singleton_perezoso(factory):
+    """Crea el recurso la primera vez que se pide y lo comparte entre hilos (y reruns)"""
+    lock = threading.Lock()
+    instancia = []
+    
+    @functools.wraps(factory)
+    def obtener():
+        if not instancia:
+            with lock:
+                if not instancia:
+                    instancia.append(factory())
+        return instancia[0]
+    return obtener
+
+# ==========================================
+# 🌐 CLIENTE HTTP COMPARTIDO
+# ==========================================
+class RetryAcotado(Retry):
+    """Respeta Retry-After, pero nunca espera más de MAX_RETRY_AFTER segundos"""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+@singleton_perezoso
+def get_http_session():
+    """Sesión keep-alive compartida por la SERP y las descargas (sobrevive a los reruns)"""
+    retry = RetryAcotado(
+        total=HTTP_REINTENTOS,
+        status=HTTP_REINTENTOS,
+        connect=1,  # la petición no llegó a enviarse: seguro también para el POST
+        read=0,     # un timeout de lectura no se repite: ni bloquea el hilo ni se cobra dos veces
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=[429, 503],
+        allowed_methods=None,  # también el POST a Serper (solo ante 429/503)
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=HTTP_POOL_POR_HOST,
+        pool_block=True,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# ==========================================
+# 💾 CACHÉS EN DISCO (PÁGINAS + SERP)
+# ==========================================
+def _abrir_sqlite(path):
+    """Conexión SQLite compartible entre hilos (protegerla con un lock)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def normalizar_url(url):
+    """Clave estable para una URL: esquema/host en minúsculas, sin fragmento ni parámetros de tracking"""
+    partes = urlsplit(url.strip())
+    esquema = partes.scheme.lower()
+    host = (partes.hostname or "").lower()
+    if partes.port and (esquema, partes.port) not in [("http", 80), ("https", 443)]:
+        host = f"{host}:{partes.port}"
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(partes.query, keep_blank_values=True)
+        if not k.lower().startswith(PARAMS_TRACKING)
+    ))
+    return urlunsplit((esquema, host, partes.path or "/", query, ""))
+
+class PageCache:
+    """Caché SQLite de HTML con TTL, validadores ETag/Last-Modified y desalojo LRU por tamaño"""
+    
+    def __init__(self, path, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = _abrir_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, content BLOB, etag TEXT, last_modified TEXT,
+                fetched_at REAL, accessed_at REAL, size INTEGER
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_lru ON pages(accessed_at)")
+    
+    def get(self, url):
+        """Devuelve la entrada (con 'fresh' según el TTL) o None"""
+        key = normalizar_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, etag, last_modified, fetched_at FROM pages WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (now, key))
+        content, etag, last_modified, fetched_at = row
+        return {
+            "content": content,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": now - fetched_at < self.ttl
+        }
+    
+    def put(self, url, content, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalizar_url(url), content, etag, last_modified, now, now, len(content))
+            )
+            self._evict()
+    
+    def touch(self, url):
+        """Marca la entrada como recién validada (respuesta 304)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                (now, now, normalizar_url(url))
+            )
+    
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        borrar = []
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            borrar.append((url,))
+            total -= size
+        self._conn.executemany("DELETE FROM pages WHERE url = ?", borrar)
+
+@singleton_perezoso
+def get_page_cache():
+    return PageCache(os.path.join(CACHE_DIR, "pages.sqlite"))
+
+class SerpCache:
+    """Caché de páginas de resultados orgánicos por (query, gl, hl, página) con ventana de frescura"""
+    
+    def __init__(self, path, ttl=SERP_CACHE_TTL):
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "api_calls_saved": 0}
+        self._lock = threading.Lock()
+        self._conn = _abrir_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS serp_paginas (
+                query TEXT, gl TEXT, hl TEXT, page INTEGER, results TEXT, fetched_at REAL,
+                PRIMARY KEY (query, gl, hl, page)
+            )""")
+    
+    @staticmethod
+    def _query_key(query):
+        return " ".join(query.lower().split())
+    
+    def get(self, query, page, gl, hl):
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT results FROM serp_paginas
+                   WHERE query = ? AND gl = ? AND hl = ? AND page = ? AND fetched_at >= ?""",
+                (self._query_key(query), gl, hl, page, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.stats["api_calls_saved"] += 1
+        return json.loads(row[0])
+    
+    def put(self, query, page, gl, hl, results):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO serp_paginas VALUES (?, ?, ?, ?, ?, ?)",
+                (self._query_key(query), gl, hl, page, json.dumps(results), time.time())
+            )
+
+@singleton_perezoso
+def get_serp_cache():
+    return SerpCache(os.path.join(CACHE_DIR, "serp.sqlite"))
+
+class AnalysisCache:
+    """Features de análisis comprimidas (JSON+zlib) por (hash de contenido, versión del analizador)"""
+    
+    def __init__(self, path, version=ANALYZER_VERSION):
+        self.version = version
+        self._lock = threading.Lock()
+        self._conn = _abrir_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis (
+                content_hash TEXT, version TEXT, data BLOB, created_at REAL,
+                PRIMARY KEY (content_hash, version)
+            )""")
+    
+    def get(self, content_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM analysis WHERE content_hash = ? AND version = ?",
+                (content_hash, self.version)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+    
+    def put(self, content_hash, features):
+        data = zlib.compress(json.dumps(features, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?)",
+                (content_hash, self.version, data, time.time())
+            )
+
+@singleton_perezoso
+def get_analysis_cache():
+    return AnalysisCache(os.path.join(CACHE_DIR, "analysis.sqlite"))
+
+# ==========================================
+# 🔍 FUNCIONES CORE MEJORADAS
+# ==========================================
+def pagina_serp(query, page, gl="es", hl="es"):
+    """Una página (1, 2, ...) de SERP_PAGINA resultados orgánicos; None si la API falla"""
+    cache = get_serp_cache()
+    cached = cache.get(query, page, gl, hl)
+    if cached is not None:
+        return cached
+    
+    url = "https://google.serper.dev/search"
+    payload = {"q": query, "num": SERP_PAGINA, "page": page, "gl": gl, "hl": hl}
+    headers = {'X-API-KEY': SERPER_API_KEY, 'Content-Type': 'application/json'}
+    try:
+        response = get_http_session().post(url, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
+        organic = response.json().get('organic', [])
+    except: return None
+    if organic:
+        cache.put(query, page, gl, hl, organic)
+    return organic
+
+class ResultadosSerp:
+    """
+    Candidatos de la SERP como iterador perezoso: pide páginas a Serper solo cuando el
+    pipeline de descargas se queda sin candidatos y descarta DOMINIOS_EXCLUIDOS y URLs
+    repetidas. Cuántas páginas pide de golpe sale de los válidos que faltan y de la tasa
+    de fallo observada, que el consumidor comunica con registrar_resultado().
+    bool() es False si la SERP no devuelve nada utilizable.
+    """
+    _tasa_global = SERP_TASA_FALLO_INICIAL  # media móvil entre ejecuciones
+    _lock_global = threading.Lock()
+    
+    def __init__(self, query, n_validos, gl="es", hl="es"):
+        self.query, self.gl, self.hl = query, gl, hl
+        self.n_validos = n_validos
+        self.paginas = 0
+        self.agotada = False
+        self.recibidos = 0
+        self.excluidos = 0
+        self.entregados = 0
+        self.ok = 0
+        self.fallos = 0
+        self._buffer = deque()
+        self._vistas = set()
+    
+    def registrar_resultado(self, valido):
+        """El consumidor informa de cada descarga terminada (válida o no)"""
+        if valido:
+            self.ok += 1
+        else:
+            self.fallos += 1
+        with ResultadosSerp._lock_global:
+            ResultadosSerp._tasa_global = 0.9 * ResultadosSerp._tasa_global + 0.1 * (not valido)
+    
+    @property
+    def tasa_fallo(self):
+        """Fallos observados en esta SERP, suavizados con la media de ejecuciones anteriores"""
+        previa = 4  # peso de la media global, en descargas
+        return (self.fallos + previa * ResultadosSerp._tasa_global) / (self.ok + self.fallos + previa)
+    
+    def _paginas_necesarias(self):
+        exito = max(1 - self.tasa_fallo, 0.1)
+        en_vuelo = self.entregados - self.ok - self.fallos
+        candidatos = (self.n_validos - self.ok) / exito - en_vuelo
+        utiles = 1 - self.excluidos / self.recibidos if self.recibidos else 1
+        brutos = candidatos / max(utiles, 0.1)
+        return max(1, int(-(-brutos // SERP_PAGINA)))
+    
+    def _pedir(self, n_paginas):
+        for _ in range(n_paginas):
+            if self.paginas >= SERP_MAX_PAGINAS:
+                self.agotada = True
+            if self.agotada:
+                return
+            self.paginas += 1
+            organic = pagina_serp(self.query, self.paginas, self.gl, self.hl)
+            if not organic:
+                self.agotada = True
+                return
+            for res in organic:
+                url = res.get('link', '')
+                if not url or url in self._vistas:
+                    continue
+                self._vistas.add(url)
+                self.recibidos += 1
+                if any(bad in url for bad in DOMINIOS_EXCLUIDOS):
+                    self.excluidos += 1
+                    continue
+                self._buffer.append(res)
+    
+    def _llenar(self):
+        while not self._buffer and not self.agotada:
+            self._pedir(self._paginas_necesarias())
+        return bool(self._buffer)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self._llenar():
+            raise StopIteration
+        self.entregados += 1
+        return self._buffer.popleft()
+    
+    def __bool__(self):
+        return self.entregados > 0 or self._llenar()
+
+def get_serper_results(query, n_needed, gl="es", hl="es"):
+    """Candidatos para reunir n_needed competidores válidos (ver ResultadosSerp)"""
+    return ResultadosSerp(query, n_needed, gl, hl)
+
+def extraer_dom(soup):
+    """
+    Recorre el documento UNA sola vez y recoge todo lo que leen los analizadores
+    (title, meta, canonical, H1/H2, enlaces, negritas, imágenes, vídeos, JSON-LD).
+    """
+    dom = {
+        "title": None, "has_title": False, "meta_description": None, "canonical": None,
+        "h1": [], "h1_raw": [], "h2": [], "strong": [], "links": [], "ld_json": [],
+        "images": 0, "images_with_alt": 0, "videos": 0
+    }
+    for el in soup.descendants:
+        if not isinstance(el, Tag):
+            continue
+        name = el.name
+        if name == 'a':
+            href = el.get('href')
+            if href is not None:
+                dom['links'].append((href, el.get('rel', [])))
+        elif name == 'img':
+            dom['images'] += 1
+            if el.get('alt'):
+                dom['images_with_alt'] += 1
+        elif name in ('video', 'iframe'):
+            dom['videos'] += 1
+        elif name in ('strong', 'b'):
+            dom['strong'].append(el.get_text())
+        elif name == 'h2':
+            dom['h2'].append(el.get_text(" ", strip=True))
+        elif name == 'h1':
+            dom['h1'].append(el.get_text(" ", strip=True))
+            dom['h1_raw'].append(el.get_text())
+        elif name == 'title' and not dom['has_title']:
+            dom['has_title'] = True
+            dom['title'] = el.string
+        elif name == 'meta' and dom['meta_description'] is None and el.get('name') == 'description':
+            dom['meta_description'] = el.get('content', '')
+        elif name == 'link' and dom['canonical'] is None and 'canonical' in el.get('rel', []):
+            dom['canonical'] = el.get('href', '')
+        elif name == 'script' and el.get('type') == 'application/ld+json':
+            dom['ld_json'].append(el.string)
+    return dom
+
+class _DomTarget:
+    """
+    Target de lxml.etree.HTMLParser: recibe eventos SAX y rellena el mismo dict que
+    extraer_dom() sin construir ningún árbol. Con quitar_boilerplate=True los subárboles
+    BOILERPLATE_TAGS se ignoran al vuelo y se acumula el texto visible restante.
+    """
+    CAPTURAS = ('h1', 'h2', 'strong', 'b', 'title', 'script')
+    
+    def __init__(self, quitar_boilerplate):
+        self.quitar_boilerplate = quitar_boilerplate
+        self.dom = {
+            "title": None, "has_title": False, "meta_description": None, "canonical": None,
+            "h1": [], "h1_raw": [], "h2": [], "strong": [], "links": [], "ld_json": [],
+            "images": 0, "images_with_alt": 0, "videos": 0
+        }
+        self.texto = []
+        self._buffer = []
+        self._pila = []      # (tag, piezas capturadas o None, hueco en la lista del dom)
+        self._activas = []   # listas de piezas que reciben el texto actual
+        self._saltar = 0     # profundidad dentro de boilerplate
+        self._opaco = 0      # script/style/template: su texto no es visible
+    
+    def _flush(self):
+        if not self._buffer:
+            return
+        pieza = "".join(self._buffer)
+        self._buffer = []
+        if self._saltar:
+            return
+        if self._opaco:
+            # Solo el propio <script type="application/ld+json"> guarda su contenido
+            tag, piezas, _ = self._pila[-1]
+            if tag == 'script' and piezas is not None:
+                piezas.append(pieza)
+            return
+        for piezas in self._activas:
+            piezas.append(pieza)
+        if self.quitar_boilerplate:
+            limpio = pieza.strip()
+            if limpio:
+                self.texto.append(limpio)
+    
+    def start(self, tag, attrib):
+        self._flush()
+        if self._saltar or (self.quitar_boilerplate and tag in BOILERPLATE_TAGS):
+            self._saltar += 1
+            self._pila.append((tag, None, None))
+            return
+        dom = self.dom
+        if tag == 'a':
+            href = attrib.get('href')
+            if href is not None:
+                dom['links'].append((href, attrib.get('rel', '').split()))
+        elif tag == 'img':
+            dom['images'] += 1
+            if attrib.get('alt'):
+                dom['images_with_alt'] += 1
+        elif tag in ('video', 'iframe'):
+            dom['videos'] += 1
+        elif tag == 'meta' and dom['meta_description'] is None and attrib.get('name') == 'description':
+            dom['meta_description'] = attrib.get('content', '')
+        elif tag == 'link' and dom['canonical'] is None and 'canonical' in attrib.get('rel', '').split():
+            dom['canonical'] = attrib.get('href', '')
+        
+        piezas = None
+        if tag in self.CAPTURAS:
+            if tag == 'script':
+                if attrib.get('type') == 'application/ld+json':
+                    piezas = []
+            elif tag != 'title' or not dom['has_title']:
+                piezas = []
+        if tag in ('script', 'style', 'template'):
+            self._opaco += 1
+        if tag == 'title' and piezas is not None:
+            dom['has_title'] = True
+        # Como extraer_dom(), el orden es el de apertura: el exterior antes que el anidado
+        hueco = None
+        if piezas is not None:
+            self._activas.append(piezas)
+            if tag in ('h1', 'h2', 'strong', 'b'):
+                lista = dom['strong'] if tag == 'b' else dom[tag]
+                hueco = len(lista)
+                lista.append(None)
+                if tag == 'h1':
+                    dom['h1_raw'].append(None)
+        self._pila.append((tag, piezas, hueco))
+    
+    def end(self, tag):
+        self._flush()
+        if not self._pila:
+            return
+        tag, piezas, hueco = self._pila.pop()
+        if self._saltar:
+            self._saltar -= 1
+            return
+        if tag in ('script', 'style', 'template'):
+            self._opaco -= 1
+        if piezas is None:
+            return
+        self._activas = [p for p in self._activas if p is not piezas]
+        dom = self.dom
+        if tag == 'h1':
+            dom['h1'][hueco] = " ".join(p.strip() for p in piezas if p.strip())
+            dom['h1_raw'][hueco] = "".join(piezas)
+        elif tag == 'h2':
+            dom['h2'][hueco] = " ".join(p.strip() for p in piezas if p.strip())
+        elif tag in ('strong', 'b'):
+            dom['strong'][hueco] = "".join(piezas)
+        elif tag == 'title':
+            dom['title'] = piezas[0] if len(piezas) == 1 else None
+        elif tag == 'script':
+            dom['ld_json'].append("".join(piezas) if piezas else None)
+    
+    def data(self, data):
+        self._buffer.append(data)
+    
+    def comment(self, text):
+        self._flush()
+    
+    def pi(self, target, data=None):
+        self._flush()
+    
+    def close(self):
+        self._flush()
+        return self.dom
+
+_RE_CAPTURADA = re.compile(r'<(/?)(title|h1|h2|strong|b)(?=[\s>/])', re.IGNORECASE)
+_RE_BLOQUE = re.compile(
+    r'<(?:p|div|h[1-6]|ul|ol|li|dl|dt|dd|table|tr|td|th|form|blockquote|pre|address|'
+    r'fieldset|hr|center|section|article)(?=[\s>/])', re.IGNORECASE)
+
+def _reparacion_distinta(markup):
+    """
+    True si libxml2 y html.parser repararían distinto algún elemento que se captura:
+    etiquetas sin cerrar o mal anidadas (un <title> abierto se traga el documento),
+    marcado dentro del <title>, o un bloque dentro de <b>/<strong>/<h1>/<h2>, que
+    libxml2 cierra antes de tiempo.
+    """
+    pila = []  # (tag, fin de la etiqueta de apertura)
+    for m in _RE_CAPTURADA.finditer(markup):
+        tag = m.group(2).lower()
+        if not m.group(1):
+            pila.append((tag, m.end()))
+            continue
+        if not pila or pila[-1][0] != tag:
+            return True
+        _, inicio = pila.pop()
+        if tag == 'title':
+            if '<' in markup[markup.find('>', inicio) + 1:m.start()]:
+                return True
+        elif _RE_BLOQUE.search(markup, inicio, m.start()):
+            return True
+    return bool(pila)
+
+def parsear_dom(html, quitar_boilerplate, modo=None):
+    """
+    Devuelve el dict de extraer_dom() (+ 'texto' si quitar_boilerplate).
+    modo "lxml": parseo en streaming sin árbol; "html.parser": BeautifulSoup clásico.
+    Ambos producen el mismo resultado: el marcado que libxml2 repararía de otra forma
+    se parsea siempre con html.parser.
+    """
+    modo = modo or PARSER_MODE
+    if modo == "lxml" and etree is not None:
+        markup = UnicodeDammit(html, is_html=True).unicode_markup if isinstance(html, bytes) else html
+        markup = re.sub(r'^\s*<\?xml[^>]*\?>', '', markup)
+        if _reparacion_distinta(markup):
+            modo = "html.parser"
+    if modo == "lxml" and etree is not None:
+        target = _DomTarget(quitar_boilerplate)
+        parser = etree.HTMLParser(target=target, no_network=True, recover=True)
+        parser.feed(markup)
+        dom = parser.close()
+        if quitar_boilerplate:
+            dom['texto'] = " ".join(target.texto)
+        return dom
+    
+    soup = BeautifulSoup(html, 'html.parser')
+    if quitar_boilerplate:
+        for tag in soup(BOILERPLATE_TAGS): 
+            tag.decompose()
+    dom = extraer_dom(soup)
+    if quitar_boilerplate:
+        dom['texto'] = soup.get_text(separator=' ', strip=True)
+    return dom
+
+def clean_h2s(h2_texts):
+    valid_h2s = []
+    for text in h2_texts:
+        if len(text) < 5 or any(bad in text.lower() for bad in H2_BLACKLIST): continue
+        valid_h2s.append(text)
+    return valid_h2s
+
+# ==========================================
+# ✂️ TOKENIZADOR ÚNICO
+# ==========================================
+class Tokenizador:
+    """
+    Única tokenización de cada página: normaliza a NFC, pasa a minúsculas, quita la
+    puntuación de cada palabra y descarta stopwords/palabras cortas en la misma pasada.
+    Entrega los tokens de uno en uno, interned (cada palabra distinta es un solo str).
+    Corpus, n-gramas, gap analysis, IDF y clustering consumen estos tokens.
+    """
+    _RE_PUNTUACION = re.compile(r'[^\w\s]')
+    
+    def __init__(self, stopwords=STOPWORDS, min_len=3):
+        self.stopwords = frozenset(stopwords)
+        self.min_len = min_len
+    
+    def tokens(self, texto):
+        if not texto:
+            return
+        if not unicodedata.is_normalized('NFC', texto):
+            texto = unicodedata.normalize('NFC', texto)
+        stopwords, min_len = self.stopwords, self.min_len
+        # Una sola copia (en minúsculas); la puntuación solo se quita de las palabras que la tienen
+        for w in texto.lower().split():
+            if not w.isalnum():
+                w = self._RE_PUNTUACION.sub('', w)
+            if len(w) >= min_len and w not in stopwords:
+                yield sys.intern(w)
+
+TOKENIZADOR = Tokenizador()
+
+# ==========================================
+# 🔎 BÚSQUEDA DE KEYWORDS (COMPILADA UNA VEZ)
+# ==========================================
+def _tabla_pliegue():
+    """
+    Letra acentuada -> letra base, solo si es un único carácter (conserva posiciones).
+    La ñ no se pliega: es otra letra ("año" no es "ano").
+    """
+    tabla = {}
+    for cp in list(range(0xC0, 0x250)) + list(range(0x1E00, 0x1F00)):
+        if cp in (0xD1, 0xF1):
+            continue
+        base = "".join(c for c in unicodedata.normalize('NFKD', chr(cp)) if not unicodedata.combining(c))
+        if len(base) == 1 and base != chr(cp):
+            tabla[cp] = base
+    return tabla
+
+_TABLA_PLIEGUE = _tabla_pliegue()
+
+# Letra base -> clase regex con todas sus variantes acentuadas ('e' -> '[eèéêë...]')
+_CLASES_ACENTOS = {}
+for _cp, _base in _TABLA_PLIEGUE.items():
+    _CLASES_ACENTOS.setdefault(_base.lower(), {_base.lower()}).add(chr(_cp).lower())
+_CLASES_ACENTOS = {base: "[" + "".join(sorted(chars)) + "]" for base, chars in _CLASES_ACENTOS.items()}
+
+def plegar_acentos(texto):
+    """'¿Qué es?' -> '¿Que es?' (la ñ se conserva)"""
+    return texto.translate(_TABLA_PLIEGUE)
+
+class KeywordMatcher:
+    """
+    Keyword objetivo + variantes compiladas una sola vez en una regex combinada, sin
+    distinguir mayúsculas ni acentos (cada letra es una clase con sus variantes, así el
+    texto no se copia ni se transforma) y con límites de palabra. Cada texto se recorre
+    una vez y se obtienen posiciones y conteos de todas las keywords a la vez.
+    """
+    def __init__(self, keywords):
+        self.keywords = [k.strip() for k in dict.fromkeys(keywords) if k and k.strip()]
+        self.principal = self.keywords[0] if self.keywords else ""
+        # Las más largas primero: "que es el repep" gana a "repep" en el mismo sitio
+        orden = sorted(range(len(self.keywords)), key=lambda i: -len(self.keywords[i]))
+        patron = "|".join(f"(?P<k{i}>{self._patron(self.keywords[i])})" for i in orden)
+        self.regex = re.compile(rf"(?<!\w)(?:{patron})(?!\w)", re.IGNORECASE) if patron else None
+    
+    @staticmethod
+    def _patron(keyword):
+        palabras = plegar_acentos(keyword.lower()).split()
+        return r"\s+".join("".join(_CLASES_ACENTOS.get(c, re.escape(c)) for c in p) for p in palabras)
+    
+    def buscar(self, texto):
+        """[(inicio, fin, keyword)] en el texto tal cual"""
+        if self.regex is None or not texto:
+            return []
+        return [(m.start(), m.end(), self.keywords[int(m.lastgroup[1:])]) for m in self.regex.finditer(texto)]
+    
+    def presentes(self, texto):
+        return {kw for _, _, kw in self.buscar(texto)}
+    
+    def zonas(self, zonas):
+        """{zona: [textos]} -> {zona: {"count", "posiciones": [(elemento, inicio, fin, keyword)]}}"""
+        resultado = {}
+        for zona, textos in zonas.items():
+            posiciones = [(i, inicio, fin, kw) for i, texto in enumerate(textos)
+                          for inicio, fin, kw in self.buscar(texto)]
+            resultado[zona] = {"count": len(posiciones), "posiciones": posiciones}
+        return resultado
+
+@functools.lru_cache(maxsize=256)
+def _matcher_cacheado(keyword):
+    return KeywordMatcher([keyword])
+
+def matcher_para(keyword):
+    """KeywordMatcher de la ejecución (o uno compilado y cacheado para una keyword suelta)"""
+    return keyword if isinstance(keyword, KeywordMatcher) else _matcher_cacheado(keyword)
+
+INTENCION_TRANSACCIONAL = ["precio", "comprar", "venta", "oferta", "tienda"]
+INTENCION_INFORMACIONAL = ["guía", "tutorial", "qué es", "cómo", "consejos"]
+
+def detectar_intencion(dom, text):
+    # Subcadenas sensibles a acentos: "como" no es "cómo" y "precios" cuenta como "precio"
+    text_lower = text.lower()
+    title_lower = dom['title'].lower() if dom['title'] else ""
+    score_trans = sum(1 for w in INTENCION_TRANSACCIONAL if w in text_lower or w in title_lower)
+    score_info = sum(1 for w in INTENCION_INFORMACIONAL if w in text_lower or w in title_lower)
+    if score_trans > score_info: return "🛒 Transaccional"
+    if score_info > score_trans: return "📚 Informacional"
+    return "⚖️ Mixto"
+
+def analizar_enlaces(dom, url):
+    """MEJORADO: Analiza enlaces internos Y externos"""
+    try:
+        domain = urlparse(url).netloc
+        
+        internal = 0
+        external = 0
+        external_nofollow = 0
+        
+        for href, rel in dom['links']:
+            if domain in href or href.startswith('/'):
+                internal += 1
+            elif href.startswith('http'):
+                external += 1
+                if 'nofollow' in rel:
+                    external_nofollow += 1
+        
+        return {
+            "internal": internal,
+            "external": external,
+            "external_nofollow": external_nofollow,
+            "external_dofollow": external - external_nofollow
+        }
+    except:
+        return {"internal": 0, "external": 0, "external_nofollow": 0, "external_dofollow": 0}
+
+def extraer_zonas_keyword(dom):
+    """Textos donde se busca la keyword (title, meta, canonical, H1, negritas)"""
+    return {
+        "title": dom['title'].strip() if dom['title'] else "",
+        "meta": dom['meta_description'] or "",
+        "canonical": dom['canonical'],
+        "h1": dom['h1_raw'],
+        "strong": dom['strong']
+    }
+
+def textos_por_zona(zonas, body=None):
+    """Zonas extraídas -> {zona: [textos]} para KeywordMatcher.zonas"""
+    canonical = zonas['canonical'] or ""
+    textos = {
+        "title": [zonas['title']],
+        "meta": [zonas['meta']],
+        # En la URL los guiones separan palabras (misma longitud: posiciones intactas)
+        "url": [re.sub(r'[-_/.+]', ' ', canonical)] if canonical else [],
+        "h1": zonas['h1'],
+        "strong": zonas['strong']
+    }
+    if body is not None:
+        textos["body"] = [body]
+    return textos
+
+def seo_onpage_desde_zonas(zonas, keyword, coincidencias=None):
+    """Checks on-page a partir de zonas ya extraídas (barato: no toca el DOM)"""
+    if not zonas:
+        return {
+            "title_length": 0, "meta_length": 0,
+            "kw_in_title": False, "kw_in_meta": False,
+            "kw_in_url": False, "kw_in_h1": False, "kw_in_strong": False
+        }
+    if coincidencias is None:
+        coincidencias = matcher_para(keyword).zonas(textos_por_zona(zonas))
+    return {
+        "title_length": len(zonas['title']),
+        "meta_length": len(zonas['meta']),
+        "kw_in_title": coincidencias['title']['count'] > 0,
+        "kw_in_meta": coincidencias['meta']['count'] > 0,
+        "kw_in_url": coincidencias['url']['count'] > 0,
+        "kw_in_h1": coincidencias['h1']['count'] > 0,
+        "kw_in_strong": coincidencias['strong']['count'] > 0
+    }
+
+def analizar_seo_onpage(dom, keyword):
+    """NUEVO: Análisis SEO on-page detallado"""
+    return seo_onpage_desde_zonas(extraer_zonas_keyword(dom), keyword)
+
+def detectar_schema_markup(dom):
+    schemas = []
+    for raw in dom['ld_json']:
+        try:
+            data = json.loads(raw)
+            if isinstance(data, dict) and '@type' in data:
+                schemas.append(data['@type'])
+            elif isinstance(data, list):
+                for item in data:
+                    if isinstance(item, dict) and '@type' in item:
+                        schemas.append(item['@type'])
+        except: pass
+    return list(set(schemas))
+
+def analizar_media_richness(dom):
+    imagenes = dom['images']
+    videos = dom['videos']
+    
+    # Imágenes CON alt text
+    imgs_with_alt = dom['images_with_alt']
+    
+    return {
+        "images": imagenes,
+        "videos": videos,
+        "total": imagenes + videos,
+        "images_with_alt": imgs_with_alt,
+        "alt_ratio": (imgs_with_alt / imagenes * 100) if imagenes > 0 else 0
+    }
+
+# ==========================================
+# 📖 LEGIBILIDAD EN ESPAÑOL
+# ==========================================
+VOCALES_FUERTES = set("aeoáéóàèò")
+VOCALES_DEBILES = set("iuü")
+VOCALES_DEBILES_TONICAS = set("íú")
+_RE_QU_GU = re.compile(r'(?<=[qg])u(?=[eiéí])')
+_RE_PALABRA = re.compile(r'[^\W\d_]+')
+_RE_FRASE = re.compile(r'[.!?…\n]+')
+
+@functools.lru_cache(maxsize=200000)
+def contar_silabas(palabra):
+    """
+    Sílabas de una palabra española: cada grupo vocálico es una sílaba salvo hiato
+    (dos vocales fuertes, o débil tónica junto a fuerte). La 'u' muda de que/qui/gue/gui
+    no cuenta y la 'y' final o ante consonante es vocal. Caché común a todos los documentos.
+    """
+    w = _RE_QU_GU.sub('', palabra.lower())
+    silabas = 0
+    previa = None  # tipo de la vocal anterior ('F', 'D', 'T') o None tras consonante
+    for i, c in enumerate(w):
+        if c == 'y' and (i + 1 == len(w) or w[i + 1] not in VOCALES_FUERTES | VOCALES_DEBILES | VOCALES_DEBILES_TONICAS):
+            tipo = 'D' if previa else 'F'  # "rey" (diptongo) / "y" suelta
+        elif c in VOCALES_FUERTES:
+            tipo = 'F'
+        elif c in VOCALES_DEBILES_TONICAS:
+            tipo = 'T'
+        elif c in VOCALES_DEBILES:
+            tipo = 'D'
+        else:
+            previa = None
+            continue
+        if previa is None or (previa == 'F' and tipo in 'FT') or (previa == 'T' and tipo == 'F'):
+            silabas += 1
+        previa = tipo
+    return max(1, silabas)
+
+def estadisticas_legibilidad(texto):
+    """(palabras, frases, sílabas) del texto en una pasada; cada palabra distinta se silabea una vez"""
+    conteo = Counter(_RE_PALABRA.findall(texto))
+    palabras = sum(conteo.values())
+    silabas = sum(n * contar_silabas(w) for w, n in conteo.items())
+    frases = sum(1 for f in _RE_FRASE.split(texto) if _RE_PALABRA.search(f))
+    return palabras, max(frases, 1), silabas
+
+def puntuar_legibilidad(palabras, frases, silabas):
+    """(Szigriszt-Pazos / INFLESZ, Fernández-Huerta); None si el texto no tiene palabras"""
+    if not palabras:
+        return None, None
+    szigriszt = 206.835 - 62.3 * silabas / palabras - palabras / frases
+    fernandez_huerta = 206.84 - 0.60 * (100.0 * silabas / palabras) - 1.02 * (100.0 * frases / palabras)
+    return szigriszt, fernandez_huerta
+
+def etiqueta_legibilidad(score):
+    """Escala INFLESZ"""
+    if score is None or score != score: return "N/A"
+    if score >= 80: return f"✅ Muy fácil ({score:.0f})"
+    elif score >= 65: return f"👍 Fácil ({score:.0f})"
+    elif score >= 55: return f"⚖️ Normal ({score:.0f})"
+    elif score >= 40: return f"⚠️ Algo difícil ({score:.0f})"
+    else: return f"❌ Difícil ({score:.0f})"
+
+def calcular_readability(text):
+    szigriszt, fernandez_huerta = puntuar_legibilidad(*estadisticas_legibilidad(text or ""))
+    if szigriszt is None:
+        return {"readability": "N/A", "readability_score": None, "fernandez_huerta": None}
+    return {
+        "readability": etiqueta_legibilidad(szigriszt),
+        "readability_score": round(szigriszt, 1),
+        "fernandez_huerta": round(fernandez_huerta, 1)
+    }
+
+def estimar_domain_authority(url):
+    domain = urlparse(url).netloc
+    score = 50
+    if domain.endswith('.edu'): score += 20
+    elif domain.endswith('.gov'): score += 25
+    elif domain.endswith('.org'): score += 10
+    if domain.count('.') > 1: score -= 10
+    if len(domain) < 15: score += 5
+    return min(max(score, 0), 100)
+
+def descargar_html(url):
+    """Descarga la página UNA sola vez (o la lee de la caché). Devuelve (html_bytes, error)"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': 'text/html,application/xhtml+xml'
+    }
+    cache = get_page_cache()
+    cached = cache.get(url)
+    if cached and cached['fresh']:
+        return cached['content'], None
+    
+    # Entrada caducada: GET condicional
+    if cached:
+        if cached['etag']: headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']: headers['If-Modified-Since'] = cached['last_modified']
+    
+    res = get_http_session().get(url, timeout=HTTP_TIMEOUT, headers=headers, verify=False)
+    if res.status_code == 304 and cached:
+        cache.touch(url)
+        return cached['content'], None
+    if res.status_code in [403, 429, 503]:
+        return None, f"Bloqueo ({res.status_code})"
+    if res.status_code >= 400:
+        return None, f"HTTP {res.status_code}"
+    cache.put(url, res.content, res.headers.get('ETag'), res.headers.get('Last-Modified'))
+    return res.content, None
+
+def hash_contenido(url, html):
+    """Huella del HTML (más el dominio, del que dependen los enlaces internos)"""
+    return hashlib.sha1(urlparse(url).netloc.encode() + b"\0" + html).hexdigest()
+
+# Rechazos que dependen solo del HTML: se pueden cachear. Cualquier otro error
+# (import perezoso, memoria...) puede ser pasajero y no se guarda
+ERROR_CONTENIDO_INSUFICIENTE = "Contenido insuficiente"
+ERROR_SIN_TITULO = "Título no detectado"
+ERRORES_DETERMINISTAS = (ERROR_CONTENIDO_INSUFICIENTE, ERROR_SIN_TITULO)
+
+def extraer_features(html, url):
+    """Parseo + analizadores independientes de la keyword (lo que se guarda en caché)"""
+    try:
+        main_text = trafilatura.extract(html, include_comments=False)
+        # Si trafilatura no extrae nada, el boilerplate se descarta durante el parseo
+        dom = parsear_dom(html, quitar_boilerplate=not main_text)
+        if not main_text:
+            main_text = dom['texto']
+        
+        if len(main_text) < 100: 
+            return {"error": ERROR_CONTENIDO_INSUFICIENTE}
+        
+        title = dom['title'].strip() if dom['title'] else "N/A"
+        if title == "N/A" or len(title) < 3: 
+            return {"error": ERROR_SIN_TITULO}
+        
+        clean_words = list(TOKENIZADOR.tokens(main_text))
+        
+        return {
+            "title": title,
+            "meta_desc": dom['meta_description'],
+            "h1": dom['h1'],
+            "h2": clean_h2s(dom['h2']),
+            "word_count": len(main_text.split()),
+            "all_words": clean_words,
+            "intencion": detectar_intencion(dom, main_text),
+            "enlaces": analizar_enlaces(dom, url),
+            "zonas_kw": extraer_zonas_keyword(dom),
+            "schemas": detectar_schema_markup(dom),
+            "media": analizar_media_richness(dom),
+            **calcular_readability(main_text),
+            "full_text": main_text
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def aplicar_keyword(features, url, target_kw, snippet_serp):
+    """
+    Completa los campos que dependen de la keyword/SERP a partir de features cacheadas.
+    target_kw: keyword o KeywordMatcher (keyword + variantes) compilado para toda la ejecución.
+    """
+    main_text = features['full_text']
+    coincidencias = matcher_para(target_kw).zonas(textos_por_zona(features['zonas_kw'], main_text))
+    return {
+        "title": features['title'],
+        "meta_desc": features['meta_desc'] if features['meta_desc'] is not None else snippet_serp,
+        "h1": features['h1'],
+        "h2": features['h2'],
+        "word_count": features['word_count'],
+        "kw_density": coincidencias['body']['count'],
+        "all_words": features['all_words'],
+        "intencion": features['intencion'],
+        "enlaces": features['enlaces'],
+        "seo_onpage": seo_onpage_desde_zonas(features['zonas_kw'], target_kw, coincidencias),
+        "kw_zonas": coincidencias,
+        "schemas": features['schemas'],
+        "media": features['media'],
+        "readability": features['readability'],
+        "readability_score": features['readability_score'],
+        "fernandez_huerta": features['fernandez_huerta'],
+        "da_proxy": estimar_domain_authority(url),
+        "full_text": main_text
+    }
+
+# Una misma URL pedida a la vez por varias keywords se descarga y parsea una sola vez:
+# el primer hilo la procesa y los demás esperan su Future. Solo esperan los duplicados
+# reales (misma URL normalizada); URLs distintas nunca se bloquean entre sí.
+_EN_VUELO = {}  # URL normalizada -> Future con (features, error)
+_EN_VUELO_LOCK = threading.Lock()
+
+def obtener_features(url):
+    """Descarga + features de la URL (con cachés). Devuelve (features, error)"""
+    clave = normalizar_url(url)
+    with _EN_VUELO_LOCK:
+        en_curso = _EN_VUELO.get(clave)
+        if en_curso is None:
+            _EN_VUELO[clave] = propio = Future()
+    if en_curso is not None:
+        return en_curso.result()
+    
+    try:
+        resultado = _obtener_features(url)
+    except BaseException as e:
+        propio.set_exception(e)
+        raise
+    else:
+        propio.set_result(resultado)
+        return resultado
+    finally:
+        with _EN_VUELO_LOCK:
+            del _EN_VUELO[clave]
+
+def _obtener_features(url):
+    # Los mismos bytes alimentan a trafilatura y a BeautifulSoup
+    html, error = descargar_html(url)
+    if error:
+        return None, error
+    
+    # HTML idéntico al de un análisis previo: no se vuelve a parsear
+    cache = get_analysis_cache()
+    key = hash_contenido(url, html)
+    features = cache.get(key)
+    if features is None:
+        features = extraer_features(html, url)
+        if features.get("error") in (None, *ERRORES_DETERMINISTAS):
+            cache.put(key, features)
+    return features, None
+
+def analyze_url_final(url, target_kw, snippet_serp):
+    """ANÁLISIS COMPLETO MEJORADO"""
+    try:
+        features, error = obtener_features(url)
+        if error:
+            return {"error": error}
+        
+        if "error" in features:
+            return {"error": features['error']}
+        return aplicar_keyword(features, url, target_kw, snippet_serp)
+    except Exception as e:
+        return {"error": str(e)}
+
+def construir_fila(res, data, corpus, pos=0):
+    """Fila de resultados de un competidor; sus tokens pasan al corpus compacto"""
+    return {
+        "Pos": pos,
+        "URL": res['link'],
+        "Título": data['title'],
+        "Meta Desc": data['meta_desc'],
+        "Palabras": data['word_count'],
+        "Intención": data['intencion'],
+        "Menciones KW": data['kw_density'],
+        "H1_list": data.get('h1', []),
+        "H2_list": data.get('h2', []),
+        "Contenido": data.get('full_text', '')[:1000],
+        "Enlaces": data.get('enlaces', {}),
+        "SEO_Onpage": data.get('seo_onpage', {}),
+        "Schemas": data.get('schemas', []),
+        "Media": data.get('media', {}),
+        "Readability": data.get('readability', 'N/A'),
+        "Readability_Score": data.get('readability_score'),
+        "DA_Proxy": data.get('da_proxy', 0),
+        "doc_id": corpus.add(data['all_words']),
+        # Los tokens y el texto completo viven solo en el corpus compacto
+        **{k: v for k, v in data.items() if k not in ('all_words', 'full_text')}
+    }
+
+def _cuota_cerrada(validos, pendientes, num_target):
+    """True si ya hay num_target válidos por delante de cualquier descarga pendiente"""
+    if len(validos) < num_target:
+        return False
+    if not pendientes:
+        return True
+    ultimo_valido = sorted(validos)[num_target - 1]
+    return ultimo_valido < min(idx for idx, _ in pendientes.values())
+
+def analizar_competidores(candidatos, target_kw, num_target, max_workers=MAX_CONEXIONES, on_resultado=None,
+                          executor=None):
+    """
+    Descarga y analiza competidores en paralelo (pool acotado de hilos).
+    Reparte candidatos de la SERP hasta reunir num_target resultados válidos,
+    cancela el trabajo sobrante y devuelve [(res, data), ...] en orden SERP.
+    Si los candidatos tienen registrar_resultado (ResultadosSerp), se les informa de
+    cada descarga para que ajusten cuánta SERP piden.
+    on_resultado(idx, res, data, n_validos) se llama en el hilo que llama por cada descarga
+    terminada (idx = orden del candidato en la SERP).
+    Con executor (pool compartido entre keywords) max_workers limita solo las tareas
+    en vuelo de esta llamada y el pool no se cierra al terminar.
+    """
+    registrar = getattr(candidatos, 'registrar_resultado', None)
+    candidatos = iter(candidatos)
+    pendientes = {}  # future -> (índice SERP, res)
+    validos = {}     # índice SERP -> (res, data)
+    siguiente = 0
+    agotado = False
+
+    propio = executor is None
+    if propio:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            # Mantener el pool lleno mientras falten resultados
+            while not agotado and len(pendientes) < max_workers and len(validos) < num_target:
+                res = next(candidatos, None)
+                if res is None:
+                    agotado = True
+                    break
+                url = res.get('link', '')
+                if not url: continue
+                future = executor.submit(analyze_url_final, url, target_kw, res.get('snippet', ''))
+                pendientes[future] = (siguiente, res)
+                siguiente += 1
+
+            if not pendientes or _cuota_cerrada(validos, pendientes, num_target):
+                break
+
+            terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for future in terminados:
+                idx, res = pendientes.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    data = {"error": str(e)}
+                if data and "error" not in data:
+                    validos[idx] = (res, data)
+                if registrar:
+                    registrar(bool(data) and "error" not in data)
+                if on_resultado:
+                    on_resultado(idx, res, data, len(validos))
+    finally:
+        for future in pendientes:
+            future.cancel()
+        if propio:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return [validos[idx] for idx in sorted(validos)[:num_target]]
+
+# ==========================================
+# 🏆 SCORE CARD VECTORIZADO
+# ==========================================
+# Columnas de la matriz de features (una fila por competidor)
+SCORE_FEATURES = [
+    "words", "h2s", "internal", "external", "media", "da",
+    "kw_in_title", "kw_in_meta", "kw_in_h1", "kw_in_strong", "has_schema"
+]
+
+# Escalones por factor: el primer umbral superado da sus puntos; si ninguno, el último valor.
+# Con "benchmark" los umbrales son multiplicadores del promedio (o de "default" si falta).
+SCORE_RULES = [
+    {"factor": "words", "feature": "words", "benchmark": "word_avg", "default": 0,
+     "umbrales": [1.2, 1.0, 0.8], "puntos": [20, 15, 10, 5]},
+    {"factor": "h2s", "feature": "h2s", "benchmark": "h2_avg", "default": 0,
+     "umbrales": [1.2, 1.0, 0.8], "puntos": [15, 12, 8, 4]},
+    {"factor": "internal_links", "feature": "internal", "benchmark": "internal_links_avg", "default": 20,
+     "umbrales": [1.2, 1.0, 0.8], "puntos": [15, 12, 8, 4]},
+    {"factor": "external_links", "feature": "external", "benchmark": "external_links_avg", "default": 5,
+     "umbrales": [1.0, 0.7], "puntos": [10, 7, 4]},
+    {"factor": "media", "feature": "media", "benchmark": "media_avg", "default": 0,
+     "umbrales": [1.2, 1.0, 0.8], "puntos": [10, 8, 5, 3]},
+    {"factor": "da", "feature": "da", "benchmark": None,
+     "umbrales": [70, 50, 30], "puntos": [15, 12, 8, 5]},
+]
+
+# Puntos por tener la keyword en cada zona (10 máx.) y por tener Schema (5)
+SEO_ONPAGE_PESOS = {"kw_in_title": 3, "kw_in_meta": 2, "kw_in_h1": 3, "kw_in_strong": 2}
+SCHEMA_PUNTOS = 5
+
+GRADOS = [(85, 'A'), (70, 'B'), (50, 'C')]
+GRADO_MINIMO = 'D'
+
+# Tabla plana de competidores: columna -> dtype
+TABLA_DTYPES = {
+    "Pos": "int32", "URL": "object", "Título": "object", "Meta Desc": "object",
+    "Palabras": "int32", "Menciones KW": "int32", "Intención": "category",
+    "DA_Proxy": "int32", "Readability": "object", "Readability_Score": "float32",
+    "Enlaces_Internos": "int32", "Enlaces_Externos": "int32", "Externos_Dofollow": "int32",
+    "Imagenes": "int32", "Videos": "int32", "Imagenes_Alt": "int32", "Media_Total": "int32",
+    "Num_H2s": "int32", "Num_Schemas": "int32", "Schemas": "object",
+    "Tiene_SEO": "bool", "kw_in_title": "bool", "kw_in_meta": "bool", "kw_in_h1": "bool",
+    "kw_in_strong": "bool", "title_length": "int32", "meta_length": "int32"
+}
+
+# Columna de la tabla que alimenta cada feature del score
+TABLA_A_SCORE = {
+    "words": "Palabras", "h2s": "Num_H2s", "internal": "Enlaces_Internos",
+    "external": "Enlaces_Externos", "media": "Media_Total", "da": "DA_Proxy",
+    "kw_in_title": "kw_in_title", "kw_in_meta": "kw_in_meta", "kw_in_h1": "kw_in_h1",
+    "kw_in_strong": "kw_in_strong", "has_schema": "Num_Schemas"
+}
+
+def construir_tabla_competidores(items):
+    """
+    Aplana UNA vez los dicts anidados (Enlaces, Media, SEO_Onpage, Schemas) en una
+    tabla columnar tipada que leen Overview, Score Card, Detalle y Exportar.
+    """
+    cols = {name: [] for name in TABLA_DTYPES}
+    for item in items:
+        enlaces = item.get('Enlaces', item.get('enlaces', {}))
+        if not isinstance(enlaces, dict): enlaces = {}
+        media = item.get('Media', item.get('media', {}))
+        if not isinstance(media, dict): media = {}
+        seo = item.get('SEO_Onpage', item.get('seo_onpage', {}))
+        if not isinstance(seo, dict): seo = {}
+        schemas = item.get('Schemas', item.get('schemas', []))
+        if not isinstance(schemas, list): schemas = []
+        
+        cols["Pos"].append(item.get('Pos', 0))
+        cols["URL"].append(item.get('URL', ''))
+        cols["Título"].append(item.get('Título', item.get('title', '')))
+        cols["Meta Desc"].append(item.get('Meta Desc', item.get('meta_desc', '')))
+        cols["Palabras"].append(item.get('Palabras', 0))
+        cols["Menciones KW"].append(item.get('Menciones KW', item.get('kw_density', 0)))
+        cols["Intención"].append(item.get('Intención', item.get('intencion', 'N/A')))
+        cols["DA_Proxy"].append(item.get('DA_Proxy', 0))
+        cols["Readability"].append(item.get('Readability', item.get('readability', 'N/A')))
+        score = item.get('Readability_Score', item.get('readability_score'))
+        cols["Readability_Score"].append(float('nan') if score is None else score)
+        cols["Enlaces_Internos"].append(enlaces.get('internal', 0))
+        cols["Enlaces_Externos"].append(enlaces.get('external', 0))
+        cols["Externos_Dofollow"].append(enlaces.get('external_dofollow', 0))
+        cols["Imagenes"].append(media.get('images', 0))
+        cols["Videos"].append(media.get('videos', 0))
+        cols["Imagenes_Alt"].append(media.get('images_with_alt', 0))
+        cols["Media_Total"].append(media.get('total', 0))
+        cols["Num_H2s"].append(len(item.get('H2_list', item.get('h2', []))))
+        cols["Num_Schemas"].append(len(schemas))
+        cols["Schemas"].append(', '.join(schemas) if schemas else 'None')
+        cols["Tiene_SEO"].append(bool(seo))
+        cols["kw_in_title"].append(bool(seo.get('kw_in_title')))
+        cols["kw_in_meta"].append(bool(seo.get('kw_in_meta')))
+        cols["kw_in_h1"].append(bool(seo.get('kw_in_h1')))
+        cols["kw_in_strong"].append(bool(seo.get('kw_in_strong')))
+        cols["title_length"].append(seo.get('title_length', 0))
+        cols["meta_length"].append(seo.get('meta_length', 0))
+    return pd.DataFrame(cols).astype(TABLA_DTYPES)
+
+def matriz_desde_tabla(tabla):
+    """Matriz (n_competidores x SCORE_FEATURES) leída directamente de las columnas tipadas"""
+    matriz = np.column_stack([tabla[TABLA_A_SCORE[f]].to_numpy(dtype=np.float64) for f in SCORE_FEATURES])
+    matriz = matriz.reshape(len(tabla), len(SCORE_FEATURES))
+    i_schema = SCORE_FEATURES.index("has_schema")
+    matriz[:, i_schema] = matriz[:, i_schema] > 0
+    return matriz
+
+def construir_matriz_features(items):
+    """Matriz de features a partir de filas sueltas (dicts de resultados)"""
+    return matriz_desde_tabla(construir_tabla_competidores(items))
+
+def calcular_scores(matriz, benchmarks):
+    """
+    Score 0-100 de todos los competidores a la vez.
+    Devuelve {'total': int[n], 'breakdown': {factor: int[n]}, 'grade': str[n]}
+    """
+    col = {name: matriz[:, i] for i, name in enumerate(SCORE_FEATURES)}
+    breakdown = {}
+    
+    for rule in SCORE_RULES:
+        x = col[rule['feature']]
+        base = benchmarks.get(rule['benchmark'], rule['default']) if rule['benchmark'] else 1
+        umbrales = np.asarray(rule['umbrales'], dtype=np.float64) * base
+        breakdown[rule['factor']] = np.select(
+            [x >= u for u in umbrales], rule['puntos'][:-1], default=rule['puntos'][-1]
+        ).astype(np.int64)
+    
+    pesos = np.array([SEO_ONPAGE_PESOS[k] for k in SEO_ONPAGE_PESOS])
+    flags = np.column_stack([col[k] for k in SEO_ONPAGE_PESOS])
+    breakdown['seo_onpage'] = (flags @ pesos).astype(np.int64)
+    breakdown['schema'] = (col['has_schema'] * SCHEMA_PUNTOS).astype(np.int64)
+    
+    total = np.sum(list(breakdown.values()), axis=0).astype(np.int64)
+    grade = np.select([total >= umbral for umbral, _ in GRADOS],
+                      [g for _, g in GRADOS], default=GRADO_MINIMO)
+    return {'total': total, 'breakdown': breakdown, 'grade': grade}
+
+def score_de_fila(scores, i):
+    """Vista del competidor i con la forma de calcular_competitor_score()"""
+    return {
+        'total': int(scores['total'][i]),
+        'breakdown': {factor: int(puntos[i]) for factor, puntos in scores['breakdown'].items()},
+        'grade': str(scores['grade'][i])
+    }
+
+def calcular_competitor_score(item, benchmarks):
+    """
+    Calcula un score 0-100 para cada competidor basado en múltiples factores
+    """
+    return score_de_fila(calcular_scores(construir_matriz_features([item]), benchmarks), 0)
+
+def get_score_color(score):
+    """Retorna color según score"""
+    if score >= 85:
+        return "🟢", "#10b981"
+    elif score >= 70:
+        return "🟡", "#f59e0b"
+    else:
+        return "🔴", "#ef4444"
+
+# ==========================================
+# 🗂️ CORPUS COMPACTO + ÍNDICE DE N-GRAMAS
+# ==========================================
+NGRAM_BITS = 21  # ids de vocabulario < 2M: un trigrama cabe en un int de 63 bits
+
+class NgramIndex:
+    """
+    Recuentos de n-gramas (1..N_MAX) construidos una vez al analizar. Cada n-grama se
+    guarda como un int empaquetado con los ids del vocabulario; nunca cruza documentos.
+    Guarda frecuencia total y frecuencia documental (en cuántos competidores aparece).
+    """
+    N_MAX = 3
+    
+    def __init__(self):
+        self.totals = {n: Counter() for n in range(1, self.N_MAX + 1)}
+        self.df = {n: Counter() for n in range(1, self.N_MAX + 1)}
+        self.n_docs = 0
+    
+    @staticmethod
+    def _grams(ids, n):
+        if n == 1:
+            return Counter(ids)
+        if n == 2:
+            return Counter((a << NGRAM_BITS) | b for a, b in zip(ids, ids[1:]))
+        return Counter((a << 2 * NGRAM_BITS) | (b << NGRAM_BITS) | c
+                       for a, b, c in zip(ids, ids[1:], ids[2:]))
+    
+    def add(self, ids):
+        for n in self.totals:
+            grams = self._grams(ids, n)
+            self.totals[n].update(grams)
+            self.df[n].update(grams.keys())
+        self.n_docs += 1
+    
+    def remove(self, ids):
+        for n in self.totals:
+            grams = self._grams(ids, n)
+            self.totals[n].subtract(grams)
+            self.df[n].subtract(grams.keys())
+            for key in grams:
+                if self.totals[n][key] <= 0:
+                    del self.totals[n][key]
+                    del self.df[n][key]
+        self.n_docs -= 1
+    
+    def top(self, n, k, palabras):
+        """[(frase, frecuencia, nº de competidores)] de los k n-gramas más frecuentes"""
+        mask = (1 << NGRAM_BITS) - 1
+        resultado = []
+        for key, count in self.totals[n].most_common(k):
+            ids = [(key >> (NGRAM_BITS * i)) & mask for i in reversed(range(n))]
+            resultado.append((" ".join(palabras[i] for i in ids), count, self.df[n][key]))
+        return resultado
+
+class CorpusStore:
+    """
+    Tokens de todos los competidores sin duplicar strings: vocabulario compartido
+    (palabra <-> id) y, por documento, un array uint32 de ids + sus term counts.
+    """
+    
+    def __init__(self):
+        self.vocab = {}     # palabra -> id
+        self.palabras = []  # id -> palabra
+        self.docs = []      # array('I') de ids por documento
+        self.counts = []    # Counter(id -> frecuencia) por documento
+        self.ngrams = NgramIndex()
+    
+    def add(self, words):
+        """Registra un documento y devuelve su doc_id"""
+        ids = array('I')
+        for w in words:
+            wid = self.vocab.get(w)
+            if wid is None:
+                wid = self.vocab[w] = len(self.palabras)
+                self.palabras.append(w)
+            ids.append(wid)
+        self.docs.append(ids)
+        self.counts.append(Counter(ids))
+        self.ngrams.add(ids)
+        return len(self.docs) - 1
+    
+    def remove(self, doc_id):
+        """Saca un documento del índice (su doc_id queda vacío)"""
+        self.ngrams.remove(self.docs[doc_id])
+        self.docs[doc_id] = array('I')
+        self.counts[doc_id] = Counter()
+    
+    def words(self, doc_id, limit=None):
+        ids = self.docs[doc_id] if limit is None else self.docs[doc_id][:limit]
+        return [self.palabras[i] for i in ids]
+    
+    def term_counts(self, doc_ids=None):
+        """Frecuencias agregadas (palabra -> n) de los documentos indicados"""
+        total = Counter()
+        for doc_id in (range(len(self.docs)) if doc_ids is None else doc_ids):
+            total.update(self.counts[doc_id])
+        return Counter({self.palabras[i]: n for i, n in total.items()})
+
+# ==========================================
+# 🔤 AGRUPACIÓN APROXIMADA DE H2S
+# ==========================================
+# Negaciones: invierten el sentido de un encabezado, así que ni se quitan como
+# stopwords ni pueden ser la palabra de más que separa dos variantes
+NEGACIONES_H2 = {"no", "sin", "nunca", "ni"}
+STOPWORDS_H2 = STOPWORDS - NEGACIONES_H2
+
+@functools.lru_cache(maxsize=65536)
+def normalizar_h2(texto):
+    """Minúsculas, sin acentos, sin puntuación y sin stopwords salvo negaciones (si queda algo)"""
+    plano = re.sub(r'[^\w\s]', ' ', plegar_acentos(texto.lower()))
+    palabras = plano.split()
+    sin_stop = [w for w in palabras if w not in STOPWORDS_H2]
+    return " ".join(sin_stop or palabras)
+
+def _shingles(texto, n=3):
+    texto = f" {texto} "
+    return {texto[i:i + n] for i in range(max(1, len(texto) - n + 1))}
+
+def _palabra_equivalente(a, b):
+    """
+    Misma palabra salvo una letra (plural, typo, "inscribirse"/"inscribirte"). Los números
+    y las palabras cortas han de coincidir, y la primera letra también, para que un
+    prefijo negativo ("ilegal", "inútil") no cuente como variante.
+    """
+    if a == b:
+        return True
+    if min(len(a), len(b)) < 4 or abs(len(a) - len(b)) > 1 or a[0] != b[0]:
+        return False
+    if any(c.isdigit() for c in a + b):
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i + (len(a) == len(b)):] == b[i + 1:]
+
+def _mismo_h2(forma_a, forma_b):
+    """
+    Confirmación por palabras de un candidato LSH: ningún número difiere, ninguna palabra
+    se sustituye por otra ("Requisitos 2023"/"Requisitos 2024", "Ventajas"/"Desventajas",
+    "baja"/"alta") y la mayoría tiene su equivalente en el otro encabezado; solo uno de
+    los dos puede añadir palabras ("Preguntas frecuentes sobre el REPEP"), y nunca una
+    negación ("Qué no es el REPEP").
+    """
+    pa, pb = forma_a.split(), forma_b.split()
+    set_a, set_b = set(pa), set(pb)
+    distintas = set_a ^ set_b
+    # Un número solo se empareja consigo mismo
+    if any(c.isdigit() for w in distintas for c in w):
+        return False
+    sueltas_a = [w for w in pa if w not in set_b and not any(_palabra_equivalente(w, v) for v in pb)]
+    sueltas_b = [w for w in pb if w not in set_a and not any(_palabra_equivalente(w, v) for v in pa)]
+    if sueltas_a and sueltas_b:
+        return False
+    if NEGACIONES_H2.intersection(sueltas_a + sueltas_b):
+        return False
+    emparejadas = len(pa) - len(sueltas_a) + len(pb) - len(sueltas_b)
+    return emparejadas / (len(pa) + len(pb)) >= H2_PALABRAS_MIN
+
+class _UnionFind:
+    def __init__(self, n):
+        self.padre = list(range(n))
+    
+    def find(self, x):
+        while self.padre[x] != x:
+            self.padre[x] = self.padre[self.padre[x]]
+            x = self.padre[x]
+        return x
+    
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.padre[max(ra, rb)] = min(ra, rb)
+
+def agrupar_h2s(documentos):
+    """
+    Agrupa los H2 de varios competidores por equivalencia aproximada.
+    documentos: una lista de H2 por competidor. Igualdad exacta tras normalizar_h2 y,
+    entre las formas distintas, MinHash + LSH sobre 3-gramas de caracteres (candidatos
+    en tiempo ~lineal) confirmados con Jaccard >= H2_JACCARD_MIN y por palabras (_mismo_h2).
+    Devuelve [{"h2", "competidores", "variantes"}] de más a menos competidores.
+    """
+    formas = {}       # forma normalizada -> índice
+    apariciones = []  # por forma: Counter de variantes originales (en minúsculas)
+    docs_por_forma = []
+    for doc_idx, h2s in enumerate(documentos):
+        for h2 in h2s:
+            forma = normalizar_h2(h2)
+            if not forma:
+                continue
+            if forma not in formas:
+                formas[forma] = len(formas)
+                apariciones.append(Counter())
+                docs_por_forma.append(set())
+            idx = formas[forma]
+            apariciones[idx][h2.lower().strip()] += 1
+            docs_por_forma[idx].add(doc_idx)
+    if not formas:
+        return []
+    
+    lista_formas = list(formas)
+    shingles = [_shingles(f) for f in lista_formas]
+    uf = _UnionFind(len(lista_formas))
+    
+    if len(lista_formas) > 1:
+        primo = (1 << 31) - 1
+        rng = np.random.default_rng(42)
+        a = rng.integers(1, primo, H2_MINHASH_PERMUTACIONES, dtype=np.int64)
+        b = rng.integers(0, primo, H2_MINHASH_PERMUTACIONES, dtype=np.int64)
+        filas = H2_MINHASH_PERMUTACIONES // H2_LSH_BANDAS
+        cubos = {}
+        for i, sh in enumerate(shingles):
+            x = np.fromiter((zlib.crc32(g.encode('utf-8')) & 0x7fffffff for g in sh), dtype=np.int64, count=len(sh))
+            firma = ((a[:, None] * x[None, :] + b[:, None]) % primo).min(axis=1)
+            for banda in range(H2_LSH_BANDAS):
+                clave = (banda, firma[banda * filas:(banda + 1) * filas].tobytes())
+                cubos.setdefault(clave, []).append(i)
+        
+        # Solo se comparan los que comparten algún cubo
+        comprobados = set()
+        for miembros in cubos.values():
+            for pos, i in enumerate(miembros):
+                for j in miembros[pos + 1:]:
+                    if (i, j) in comprobados or uf.find(i) == uf.find(j):
+                        continue
+                    comprobados.add((i, j))
+                    inter = len(shingles[i] & shingles[j])
+                    if (inter / (len(shingles[i]) + len(shingles[j]) - inter) >= H2_JACCARD_MIN
+                            and _mismo_h2(lista_formas[i], lista_formas[j])):
+                        uf.union(i, j)
+    
+    grupos = {}
+    for i in range(len(lista_formas)):
+        grupo = grupos.setdefault(uf.find(i), {"variantes": Counter(), "docs": set()})
+        grupo["variantes"].update(apariciones[i])
+        grupo["docs"] |= docs_por_forma[i]
+    
+    resultado = []
+    for grupo in grupos.values():
+        variantes = sorted(grupo["variantes"].items(), key=lambda x: (-x[1], len(x[0]), x[0]))
+        resultado.append({"h2": variantes[0][0], "competidores": len(grupo["docs"]),
+                          "variantes": [v for v, _ in variantes]})
+    return sorted(resultado, key=lambda g: (-g["competidores"], g["h2"]))
+
+class GapAcumulado:
+    """
+    Gap analysis incremental: los competidores entran (o salen) de uno en uno y se
+    actualizan contadores de H2/palabras y sumas para los promedios en vivo.
+    """
+    BENCHMARKS = ["h2_avg", "word_avg", "media_avg", "internal_links_avg", "external_links_avg"]
+    
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.n = 0
+        self.h2s = {}  # doc_id -> H2 del competidor (se agrupan al pedir el resultado)
+        self.word_ids = Counter()
+        self.sumas = dict.fromkeys(self.BENCHMARKS, 0)
+    
+    @staticmethod
+    def _valores(item):
+        enlaces = item.get('Enlaces', item.get('enlaces', {}))
+        if not isinstance(enlaces, dict): enlaces = {}
+        media = item.get('Media', item.get('media', {}))
+        if not isinstance(media, dict): media = {}
+        return {
+            "h2_avg": len(item.get('H2_list', item.get('h2', []))),
+            "word_avg": item.get('Palabras', item.get('word_count', 0)),
+            "media_avg": media.get('total', 0),
+            "internal_links_avg": enlaces.get('internal', 0),
+            "external_links_avg": enlaces.get('external', 0)
+        }
+    
+    def _aplicar(self, item, signo):
+        words = self.corpus.counts[item['doc_id']]
+        if signo > 0:
+            self.h2s[item['doc_id']] = list(item.get('H2_list', item.get('h2', [])))
+            self.word_ids.update(words)
+        else:
+            self.h2s.pop(item['doc_id'], None)
+            self.word_ids.subtract(words)
+            self.word_ids = +self.word_ids
+        for key, value in self._valores(item).items():
+            self.sumas[key] += signo * value
+        self.n += signo
+    
+    def add(self, item):
+        self._aplicar(item, 1)
+    
+    def remove(self, item):
+        self._aplicar(item, -1)
+    
+    def benchmarks(self):
+        """Promedios actuales (running means)"""
+        return {key: (total / self.n if self.n else 0.0) for key, total in self.sumas.items()}
+    
+    def resultado(self):
+        # H2 casi iguales cuentan juntos, y cada competidor una sola vez
+        threshold = self.n * 0.5
+        criticos = [g for g in agrupar_h2s(list(self.h2s.values())) if g['competidores'] >= threshold]
+        palabras = self.corpus.palabras
+        top_words = sorted(self.word_ids.items(), key=lambda x: (-x[1], palabras[x[0]]))[:30]
+        return {
+            "h2s_criticos": {g['h2']: g['competidores'] for g in criticos},
+            "h2_variantes": {g['h2']: g['variantes'] for g in criticos},
+            "palabras_clave_secundarias": [(palabras[wid], count) for wid, count in top_words],
+            "coverage_benchmark": self.benchmarks()
+        }
+
+def calcular_gap_analysis(data_list, keyword, corpus):
+    acumulado = GapAcumulado(corpus)
+    for item in data_list:
+        acumulado.add(item)
+    return acumulado.resultado()
+
+# ==========================================
+# 📚 ESTADÍSTICAS IDF POR MERCADO (PERSISTENTES)
+# ==========================================
+# Espacio de features hasheadas de la IDF (el clustering lo pliega a CLUSTER_N_FEATURES)
+N_FEATURES_HASH = 2 ** 18
+
+def _tokens_ya_hechos(tokens):
+    return tokens
+
+def vectorizador_hash(**kwargs):
+    """HashingVectorizer sobre listas de tokens del Tokenizador (no vuelve a tokenizar)"""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(n_features=N_FEATURES_HASH, alternate_sign=False,
+                             analyzer=_tokens_ya_hechos, **kwargs)
+
+def indice_hash(termino):
+    """Columna del término en el espacio de HashingVectorizer"""
+    from sklearn.utils import murmurhash3_32
+    return abs(murmurhash3_32(termino, seed=0)) % N_FEATURES_HASH
+
+class IdfStore:
+    """
+    Frecuencia documental acumulada de todas las páginas analizadas en un mercado (gl/hl),
+    indexada por feature hasheada: no hay vocabulario que ajustar, solo se suma.
+    El array vive en un fichero memory-mapped que comparten varios procesos; las
+    actualizaciones se serializan con un lock (y flock entre procesos).
+    La última celda guarda el número de documentos.
+    """
+    def __init__(self, gl="es", hl="es", directorio=CACHE_DIR):
+        os.makedirs(directorio, exist_ok=True)
+        base = os.path.join(directorio, f"idf_{gl}_{hl}")
+        self.path = base + ".bin"
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                f.truncate((N_FEATURES_HASH + 1) * 4)
+        self.df = np.memmap(self.path, dtype=np.uint32, mode='r+', shape=(N_FEATURES_HASH + 1,))
+        self.conn = _abrir_sqlite(base + ".sqlite")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vistos (clave TEXT PRIMARY KEY)")
+        self._lock_path = base + ".lock"
+        self.lock = threading.Lock()
+        self._vectorizer = None
+    
+    @property
+    def n_docs(self):
+        return int(self.df[N_FEATURES_HASH])
+    
+    def vectorizer(self):
+        if self._vectorizer is None:
+            self._vectorizer = vectorizador_hash(norm=None)
+        return self._vectorizer
+    
+    def registrar(self, documentos):
+        """Suma a la DF los documentos [(clave, tokens)] no vistos antes. Devuelve cuántos entraron"""
+        with self.lock:
+            nuevos = []
+            for clave, tokens in documentos:
+                cur = self.conn.execute("INSERT OR IGNORE INTO vistos (clave) VALUES (?)", (normalizar_url(clave),))
+                if cur.rowcount:
+                    nuevos.append(tokens)
+            if not nuevos:
+                return 0
+            X = self.vectorizer().transform(nuevos)
+            columnas = X.nonzero()[1]  # una entrada por (documento, término presente)
+            with open(self._lock_path, 'a') as lock_file:
+                if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    np.add.at(self.df, columnas, 1)
+                    self.df[N_FEATURES_HASH] += len(nuevos)
+                    self.df.flush()
+                finally:
+                    if fcntl: fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return len(nuevos)
+    
+    def idf(self, columnas=None):
+        """IDF suavizado (como TfidfVectorizer): ln((1 + N) / (1 + df)) + 1"""
+        df = self.df[:N_FEATURES_HASH] if columnas is None else self.df[columnas]
+        return np.log((1.0 + self.n_docs) / (1.0 + df.astype(np.float64))) + 1.0
+    
+    def transform(self, documentos):
+        """TF-IDF (normalizado L2) de listas de tokens con la IDF acumulada: solo transform, nunca fit"""
+        from sklearn.preprocessing import normalize
+        X = self.vectorizer().transform(documentos).tocsr()
+        X.data = X.data * self.idf(X.indices)
+        return normalize(X)
+    
+    def palabras_clave(self, conteos, k=30):
+        """Top-k términos por tf * idf a partir de un Counter {término: tf}"""
+        if not conteos:
+            return []
+        terminos = list(conteos)
+        pesos = np.array([conteos[t] for t in terminos], dtype=np.float64) * \
+            self.idf(np.array([indice_hash(t) for t in terminos]))
+        orden = np.argsort(-pesos, kind='stable')[:k]
+        return [(terminos[i], round(float(pesos[i]), 2)) for i in orden]
+
+_idf_stores = {}
+_idf_lock = threading.Lock()
+
+def get_idf_store(gl="es", hl="es"):
+    """Un IdfStore por mercado, compartido por todo el proceso"""
+    with _idf_lock:
+        if (gl, hl) not in _idf_stores:
+            _idf_stores[(gl, hl)] = IdfStore(gl, hl)
+        return _idf_stores[(gl, hl)]
+
+def registrar_en_idf(data_list, corpus, idf):
+    """Alta de los competidores de una ejecución en la DF del mercado"""
+    idf.registrar([(item.get('URL', ''), corpus.words(item['doc_id'])) for item in data_list])
+
+def palabras_distintivas(data_list, corpus, idf, k=30):
+    """Términos que más distinguen a estos competidores frente al resto del mercado"""
+    return idf.palabras_clave(corpus.term_counts([item['doc_id'] for item in data_list]), k)
+
+# ==========================================
+# 🧭 CLUSTERING TEMÁTICO ESCALABLE
+# ==========================================
+class MotorClustering:
+    """
+    Clustering temático para miles de documentos: vectores dispersos por hashing (sin
+    vocabulario que ajustar), MiniBatchKMeans con k elegido por silhouette sobre una
+    muestra, y alta incremental (partial_fit + predict por lotes) sin reentrenar todo.
+    Con idf (IdfStore) los vectores se ponderan con la IDF acumulada del mercado.
+    Los vectores se pliegan de N_FEATURES_HASH a CLUSTER_N_FEATURES columnas (índice
+    módulo 2^14, igual que hashear directamente a 2^14): los centroides son densos y
+    con 2^18 columnas cada ajuste costaba segundos.
+    """
+    def __init__(self, k_max=CLUSTER_K_MAX, muestra=CLUSTER_MUESTRA_SILHOUETTE, lote=CLUSTER_LOTE,
+                 random_state=42, idf=None):
+        self.idf = idf
+        self.k_max = k_max
+        self.muestra = muestra
+        self.lote = lote
+        self.random_state = random_state
+        self.claves = {}      # clave (URL) -> posición
+        self.payloads = []
+        self.terminos = []    # términos más frecuentes de cada documento (etiquetas de tema)
+        self.labels = []      # -1 = aún sin asignar
+        self.modelo = None
+        self._pendientes = []  # (posición, tokens)
+        self._vectorizer = None
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.payloads)
+    
+    def _vectorizar(self, documentos):
+        from scipy.sparse import csr_matrix
+        from sklearn.preprocessing import normalize
+        if self.idf is not None:
+            X = self.idf.transform(documentos)
+        else:
+            if self._vectorizer is None:
+                self._vectorizer = vectorizador_hash()
+            X = self._vectorizer.transform(documentos).tocsr()
+        X = csr_matrix((X.data, X.indices % CLUSTER_N_FEATURES, X.indptr),
+                       shape=(X.shape[0], CLUSTER_N_FEATURES))
+        X.sum_duplicates()
+        return normalize(X)
+    
+    def _elegir_k(self, X):
+        """
+        (k, centroides) con mejor silhouette (sobre una muestra); a igualdad, el menor.
+        k <= n/2 (con pocos documentos no hay más temas que pares) y, hasta
+        CLUSTER_KMEANS_MAX_DOCS, KMeans exacto: con pocos documentos es lo más rápido.
+        """
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+        from sklearn.metrics import silhouette_score
+        
+        n = X.shape[0]
+        if n > self.muestra:
+            filas = np.random.default_rng(self.random_state).choice(n, self.muestra, replace=False)
+            X = X[filas]
+            n = self.muestra
+        algoritmo = KMeans if n <= CLUSTER_KMEANS_MAX_DOCS else MiniBatchKMeans
+        mejor_k, mejor, centros = 2, -2.0, None
+        for k in range(2, max(2, min(self.k_max, n // 2, n - 1)) + 1):
+            modelo = algoritmo(n_clusters=k, random_state=self.random_state, n_init=3)
+            labels = modelo.fit_predict(X)
+            if len(set(labels)) < 2:
+                continue
+            score = silhouette_score(X, labels)
+            if score > mejor + 1e-9:
+                mejor_k, mejor, centros = k, score, modelo.cluster_centers_
+        return mejor_k, centros
+    
+    def _procesar_pendientes(self, forzar=False):
+        if not self._pendientes or (not forzar and len(self._pendientes) < self.lote):
+            return
+        if self.modelo is None and len(self._pendientes) < 3:
+            return
+        from sklearn.cluster import MiniBatchKMeans
+        
+        posiciones = [pos for pos, _ in self._pendientes]
+        X = self._vectorizar([tokens for _, tokens in self._pendientes])
+        if self.modelo is None:
+            # Se parte de los centroides del mejor k: un único ajuste más
+            k, centros = self._elegir_k(X)
+            self.modelo = MiniBatchKMeans(n_clusters=k, random_state=self.random_state, batch_size=1024,
+                                          **({"init": centros, "n_init": 1} if centros is not None else {"n_init": 3}))
+            labels = self.modelo.fit_predict(X)
+        else:
+            # Documentos nuevos: se actualizan los centroides y se asignan, sin reentrenar
+            self.modelo.partial_fit(X)
+            labels = self.modelo.predict(X)
+        for pos, label in zip(posiciones, labels):
+            self.labels[pos] = int(label)
+        self._pendientes = []
+    
+    def add(self, clave, tokens, payload, keyword=None):
+        """Alta de un documento (una URL repetida solo suma la keyword)"""
+        with self._lock:
+            if clave in self.claves:
+                if keyword:
+                    keywords = self.payloads[self.claves[clave]].setdefault('keywords', [])
+                    if keyword not in keywords:
+                        keywords.append(keyword)
+                return
+            self.claves[clave] = len(self.payloads)
+            if keyword:
+                payload = {**payload, 'keywords': [keyword]}
+            self.payloads.append(payload)
+            self.terminos.append(Counter(tokens).most_common(20))
+            self.labels.append(-1)
+            self._pendientes.append((len(self.payloads) - 1, tokens))
+            self._procesar_pendientes()
+    
+    def grupos(self):
+        """{cluster_id: [payload, ...]} con todos los documentos asignados"""
+        with self._lock:
+            self._procesar_pendientes(forzar=True)
+            cluster_groups = {}
+            for payload, label in zip(self.payloads, self.labels):
+                if label >= 0:
+                    cluster_groups.setdefault(label, []).append(payload)
+            return dict(sorted(cluster_groups.items()))
+    
+    def temas(self, n_terminos=5):
+        """Mapa temático: grupos con sus términos más frecuentes"""
+        grupos = self.grupos()
+        temas = []
+        for label, payloads in sorted(grupos.items()):
+            terminos = Counter()
+            for pos, doc_label in enumerate(self.labels):
+                if doc_label == label:
+                    terminos.update(dict(self.terminos[pos]))
+            temas.append({"id": label, "terminos": [t for t, _ in terminos.most_common(n_terminos)],
+                          "documentos": payloads})
+        return temas
+
+def tokens_clustering(item, corpus):
+    """H2s + primeros 100 tokens del corpus: lo que se agrupa de cada competidor"""
+    h2_list = item.get('H2_list', item.get('h2', []))
+    return list(TOKENIZADOR.tokens(" ".join(h2_list))) + corpus.words(item['doc_id'], limit=100)
+
+def realizar_clustering(data_list, corpus, idf=None):
+    """Agrupa URLs por similitud semántica"""
+    if len(data_list) < 3:
+        return None
+    
+    try:
+        motor = MotorClustering(idf=idf)
+        for item in data_list:
+            motor.add(item.get('URL', '') or str(item['doc_id']), tokens_clustering(item, corpus),
+                      {"url": item.get('URL', ''), "title": item.get('Título', item.get('title', 'N/A'))})
+        return motor.grupos() or None
+    except:
+        return None
+
+# ==========================================
+# 📦 MODO LOTE (MUCHAS KEYWORDS)
+# ==========================================
+def leer_keywords(contenido, nombre=""):
+    """Keywords de un TXT (una por línea) o CSV (primera columna), sin duplicados"""
+    texto = UnicodeDammit(contenido).unicode_markup if isinstance(contenido, bytes) else contenido
+    keywords = []
+    for linea in texto.splitlines():
+        if nombre.lower().endswith('.csv'):
+            linea = linea.split(';' if ';' in linea and ',' not in linea else ',')[0].strip('"\' ')
+        kw = linea.strip()
+        if kw and kw.lower() not in ('keyword', 'keywords', 'query'):
+            keywords.append(kw)
+    return list(dict.fromkeys(keywords))
+
+def ruta_resultado_lote(out_dir, keyword):
+    slug = re.sub(r'[^\w]+', '-', keyword.lower()).strip('-')[:60] or "kw"
+    return os.path.join(out_dir, f"{slug}-{hashlib.sha1(keyword.encode('utf-8')).hexdigest()[:8]}.json")
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+def analizar_keyword(keyword, num_target, max_workers=MAX_CONEXIONES, executor=None, gl="es", hl="es",
+                     motor=None, variantes=()):
+    """
+    Pipeline completo de una keyword (SERP, competidores, score, gap, clustering) como dict
+    serializable. Las variantes cuentan como menciones de la keyword.
+    Con motor (MotorClustering) sus competidores se suman al mapa temático común.
+    """
+    salida = salida_vacia(keyword, gl, hl)
+    raw_results = get_serper_results(keyword, num_target, gl=gl, hl=hl)
+    if not raw_results:
+        salida["estado"] = "sin SERP"
+        return salida
+    
+    matcher = KeywordMatcher([keyword, *variantes])
+    resultados = analizar_competidores(raw_results, matcher, num_target,
+                                       max_workers=max_workers, executor=executor)
+    corpus = CorpusStore()
+    final_data = [construir_fila(res, data, corpus, pos) for pos, (res, data) in enumerate(resultados, 1)]
+    if not final_data:
+        salida["estado"] = "sin resultados"
+        return salida
+    
+    # La DF del mercado crece con cada ejecución; IDF y clustering solo hacen transform
+    idf = get_idf_store(gl, hl)
+    registrar_en_idf(final_data, corpus, idf)
+    gap = calcular_gap_analysis(final_data, keyword, corpus)
+    gap['palabras_distintivas'] = palabras_distintivas(final_data, corpus, idf)
+    clusters = realizar_clustering(final_data, corpus, idf)
+    if motor is not None:
+        for fila in final_data:
+            motor.add(fila['URL'], tokens_clustering(fila, corpus),
+                      {"url": fila['URL'], "title": fila['Título']}, keyword)
+    return completar_salida(salida, final_data, gap, clusters)
+
+def salida_vacia(keyword, gl="es", hl="es"):
+    return {"keyword": keyword, "gl": gl, "hl": hl, "fecha": datetime.now().isoformat(timespec='seconds'),
+            "estado": "ok", "competidores": [], "h2s": {}, "gap_analysis": None, "clusters": None}
+
+def completar_salida(salida, final_data, gap, clusters):
+    """Tabla con score/grado, H2s, gap y clusters de una ejecución ya terminada"""
+    tabla = construir_tabla_competidores(final_data)
+    scores = calcular_scores(matriz_desde_tabla(tabla), gap['coverage_benchmark'])
+    tabla['Score'] = scores['total']
+    tabla['Grado'] = scores['grade']
+    salida.update({
+        "competidores": tabla.to_dict('records'),
+        "h2s": {fila['URL']: fila['H2_list'] for fila in final_data},
+        "gap_analysis": gap,
+        "clusters": {int(k): v for k, v in clusters.items()} if clusters else None
+    })
+    return salida
+
+def guardar_json(salida, ruta):
+    """Escritura atómica: un JSON a medias nunca queda con el nombre final"""
+    tmp = ruta + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(salida, f, ensure_ascii=False, default=_json_default)
+    os.replace(tmp, ruta)
+
+def analizar_keyword_lote(keyword, num_target, executor, max_workers, out_dir, motor=None):
+    """Una keyword del lote sobre el pool de descargas compartido; escribe su JSON"""
+    salida = analizar_keyword(keyword, num_target, max_workers=max_workers, executor=executor, motor=motor)
+    if salida['estado'] != "ok":
+        return {"keyword": keyword, "estado": salida['estado'], "competidores": 0}
+    ruta = ruta_resultado_lote(out_dir, keyword)
+    guardar_json(salida, ruta)
+    return {"keyword": keyword, "estado": "ok", "competidores": len(salida['competidores']),
+            "word_avg": salida['gap_analysis']['coverage_benchmark']['word_avg'], "archivo": ruta}
+
+def analizar_lote(keywords, num_target, out_dir=LOTE_DIR, max_conexiones=MAX_CONEXIONES,
+                  keywords_paralelo=LOTE_KEYWORDS_PARALELO, reanudar=True, on_keyword=None):
+    """
+    Analiza una lista de keywords. Todas comparten un único pool de descargas y las
+    cachés de páginas/análisis, así que una URL que rankea para varias keywords se
+    descarga y parsea una vez. Varias keywords avanzan a la vez (pool exterior, que solo
+    orquesta) para que el pool de descargas no se quede sin trabajo.
+    on_keyword(resumen, hechas, total) se llama en el hilo que llama al acabar cada keyword.
+    Al terminar escribe MAPA_TEMATICO con los temas comunes a las keywords analizadas
+    (las ya exportadas no entran).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    mapa = MotorClustering(idf=get_idf_store())
+    resumen = []
+    pendientes = []
+    for kw in keywords:
+        if reanudar and os.path.exists(ruta_resultado_lote(out_dir, kw)):
+            resumen.append({"keyword": kw, "estado": "ya exportada", "competidores": None,
+                            "archivo": ruta_resultado_lote(out_dir, kw)})
+        else:
+            pendientes.append(kw)
+    
+    total = len(keywords)
+    if on_keyword:
+        for r in resumen:
+            on_keyword(r, len(resumen), total)
+    
+    descargas = ThreadPoolExecutor(max_workers=max_conexiones)
+    orquestador = ThreadPoolExecutor(max_workers=max(1, keywords_paralelo))
+    try:
+        futures = {orquestador.submit(analizar_keyword_lote, kw, num_target, descargas,
+                                      max_conexiones, out_dir, mapa): kw for kw in pendientes}
+        for future in as_completed(futures):
+            try:
+                r = future.result()
+            except Exception as e:
+                r = {"keyword": futures[future], "estado": f"error: {e}", "competidores": 0}
+            resumen.append(r)
+            if on_keyword:
+                on_keyword(r, len(resumen), total)
+    finally:
+        orquestador.shutdown(wait=False, cancel_futures=True)
+        descargas.shutdown(wait=False, cancel_futures=True)
+    
+    if len(mapa) >= 3:
+        guardar_json({"fecha": datetime.now().isoformat(timespec='seconds'), "documentos": len(mapa),
+                      "temas": mapa.temas()}, os.path.join(out_dir, MAPA_TEMATICO))
+    
+    orden = {kw: i for i, kw in enumerate(keywords)}
+    return sorted(resumen, key=lambda r: orden.get(r['keyword'], 0))
+
+# ==========================================
+# 🌍 MULTI-MERCADO
+# ==========================================
+def analizar_mercados(keyword, mercados, num_target, max_conexiones=MAX_CONEXIONES, variantes=(),
+                      on_mercado=None):
+    """
+    Analiza la keyword en varios mercados (claves de MERCADOS) a la vez: una consulta SERP
+    por mercado en paralelo y un pool de descargas común con hueco para todos, de modo que
+    el tiempo total se parece al de un solo mercado. Una URL que rankea en varios mercados
+    se descarga y parsea una vez (single-flight + cachés).
+    on_mercado(mercado, salida) se llama en el hilo que llama. Devuelve {mercado: salida}.
+    """
+    salidas = {}
+    if not mercados:
+        return salidas
+    descargas = ThreadPoolExecutor(max_workers=max_conexiones * len(mercados))
+    orquestador = ThreadPoolExecutor(max_workers=len(mercados))
+    try:
+        futures = {orquestador.submit(analizar_keyword, keyword, num_target, max_conexiones, descargas,
+                                      MERCADOS[m][0], MERCADOS[m][1], None, variantes): m for m in mercados}
+        for future in as_completed(futures):
+            mercado = futures[future]
+            try:
+                salidas[mercado] = future.result()
+            except Exception as e:
+                gl, hl, _ = MERCADOS[mercado]
+                salidas[mercado] = {**salida_vacia(keyword, gl, hl), "estado": f"error: {e}"}
+            if on_mercado:
+                on_mercado(mercado, salidas[mercado])
+    finally:
+        orquestador.shutdown(wait=False, cancel_futures=True)
+        descargas.shutdown(wait=False, cancel_futures=True)
+    return {m: salidas[m] for m in mercados}
+
+def comparar_mercados(salidas):
+    """
+    Comparativa lado a lado: posición de cada URL en cada mercado, competidores comunes
+    (a todos los mercados con resultados) y exclusivos, benchmarks por mercado con su diferencia (%) frente al primero, y
+    H2 críticos que comparten todos.
+    """
+    mercados = list(salidas)
+    urls = {}  # URL normalizada -> {"URL", mercado: Pos}
+    for mercado, salida in salidas.items():
+        for fila in salida['competidores']:
+            urls.setdefault(normalizar_url(fila['URL']), {"URL": fila['URL']})[mercado] = int(fila['Pos'])
+    
+    posiciones = []
+    for fila in urls.values():
+        presentes = [m for m in mercados if m in fila]
+        posiciones.append({"URL": fila["URL"], **{m: fila.get(m) for m in mercados}, "Mercados": len(presentes)})
+    posiciones.sort(key=lambda f: (-f["Mercados"], min(f[m] for m in mercados if f[m] is not None)))
+    con_resultados = [m for m in mercados if salidas[m]['competidores']]
+    
+    benchmarks = {m: s['gap_analysis']['coverage_benchmark'] for m, s in salidas.items() if s['gap_analysis']}
+    referencia = benchmarks.get(mercados[0])
+    diferencias = {}
+    if referencia:
+        for m in mercados[1:]:
+            if m in benchmarks:
+                diferencias[m] = {k: ((v - referencia[k]) / referencia[k] * 100 if referencia[k] else 0.0)
+                                  for k, v in benchmarks[m].items()}
+    
+    criticos = [set(s['gap_analysis']['h2s_criticos']) for s in salidas.values() if s['gap_analysis']]
+    return {
+        "mercados": mercados,
+        "estados": {m: s['estado'] for m, s in salidas.items()},
+        "posiciones": posiciones,
+        # Con un solo mercado con resultados no hay nada compartido (todo es exclusivo)
+        "compartidas": [f["URL"] for f in posiciones if f["Mercados"] == len(con_resultados)]
+                       if len(con_resultados) >= 2 else [],
+        "exclusivas": {m: [f["URL"] for f in posiciones if f["Mercados"] == 1 and f[m] is not None]
+                       for m in mercados},
+        "benchmarks": benchmarks,
+        "diferencias": diferencias,
+        "h2s_compartidos": sorted(set.intersection(*criticos)) if criticos else []
+    }
+
+# ==========================================
+# 📄 INFORME GAP ANALYSIS
+# ==========================================
+def construir_gap_report(gap, keyword, n_competidores):
+    """Texto del informe Gap Analysis para exportar"""
+    bench = gap['coverage_benchmark']
+    gap_text = f"""
+========================================
+SERP X-RAY 360™ - GAP ANALYSIS REPORT
+========================================
+Keyword: {keyword}
+Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M')}
+Competidores analizados: {n_competidores}
+
+========================================
+📊 BENCHMARKS OBLIGATORIOS
+========================================
+• Palabras mínimas: {int(bench['word_avg'] * 1.2)} palabras (promedio: {int(bench['word_avg'])})
+• H2s recomendados: {int(bench['h2_avg'])} secciones
+• Enlaces internos: {int(bench['internal_links_avg'])} links
+• Enlaces externos: {int(bench['external_links_avg'])} links
+• Imágenes/Videos: {int(bench['media_avg'])} elementos multimedia
+
+========================================
+🔴 H2S CRÍTICOS (Secciones Obligatorias)
+========================================
+Estas secciones aparecen en +50% de competidores.
+DEBES incluirlas en tu artículo:
+
+"""
+    if gap['h2s_criticos']:
+        for h2, count in sorted(gap['h2s_criticos'].items(), key=lambda x: x[1], reverse=True):
+            gap_text += f"• {h2.title()} (aparece en {count} competidores)\n"
+    else:
+        gap_text += "• Sin H2s consistentes (cada competidor usa estructura diferente)\n"
+    
+    gap_text += f"""
+
+========================================
+📝 PALABRAS CLAVE SECUNDARIAS (Top 30)
+========================================
+Incluye estas palabras de forma natural en tu texto:
+
+"""
+    for word, count in gap['palabras_clave_secundarias'][:30]:
+        gap_text += f"• {word} ({count} menciones)\n"
+    
+    gap_text += f"""
+
+========================================
+✅ CHECKLIST DE CONTENIDO
+========================================
+Antes de publicar, verifica:
+
+[ ] Artículo tiene +{int(bench['word_avg'] * 1.2)} palabras
+[ ] Incluye TODOS los H2s críticos listados arriba
+[ ] Tiene {int(bench['h2_avg'])}+ secciones H2
+[ ] Contiene {int(bench['internal_links_avg'])}+ enlaces internos
+[ ] Cita {int(bench['external_links_avg'])}+ fuentes externas de autoridad
+[ ] Incluye {int(bench['media_avg'])}+ imágenes (todas con ALT text)
+[ ] Title tag tiene 50-60 caracteres
+[ ] Meta description tiene 150-160 caracteres
+[ ] Keyword principal en: Title, Meta, H1, URL
+[ ] Usa las palabras clave secundarias del listado
+[ ] Responde las preguntas frecuentes del sector
+[ ] Tiene Schema Markup (mínimo: Article)
+
+========================================
+🎯 ESTRATEGIA RECOMENDADA
+========================================
+"""
+    if bench['word_avg'] > 2000:
+        gap_text += "• Keyword COMPETITIVA: Necesitas contenido excepcional (+2500 palabras)\n"
+    else:
+        gap_text += "• Keyword MODERADA: Contenido sólido puede rankear (1800-2200 palabras)\n"
+    
+    gap_text += f"""• Supera el promedio en TODAS las métricas en un 20%
+• Cubre TODOS los H2s críticos identificados
+• Agrega valor único que los competidores NO tienen
+
+========================================
+Generado por SERP X-RAY 360™ PRO
+========================================
+"""
+    return gap_text
@@ -1,24 +1,23 @@
 import streamlit as st
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
-import re
-from collections import Counter
-import trafilatura
-import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import json
-from textstat import flesch_reading_ease
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from urllib.parse import urlparse
 import time
+import uuid
+
+import seo_core
+from seo_core import (
+    CorpusStore, GapAcumulado, LOTE_DIR, LOTE_KEYWORDS_PARALELO, MAX_CONEXIONES, MERCADOS,
+    analizar_competidores, analizar_lote, analizar_mercados, comparar_mercados, completar_salida, salida_vacia,
+    calcular_scores, construir_fila, construir_gap_report,
+    construir_tabla_competidores, get_score_color, get_serp_cache, get_serper_results,
+    leer_keywords, matriz_desde_tabla, realizar_clustering, score_de_fila,
+    get_idf_store, registrar_en_idf, palabras_distintivas, KeywordMatcher,
+    np, pd  # diferidos: no se importan hasta que hay resultados que pintar
+)
 
 # ==========================================
 # 🔧 CONFIGURACIÓN INICIAL
 # ==========================================
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 st.set_page_config(
     page_title="SERP X-RAY 360™ PRO", 
     layout="wide", 
@@ -275,10 +274,10 @@ HELP_TEXTS = {
     },
     "readability": {
         "title": "📖 Legibilidad",
-        "simple": "Qué tan fácil es leer el texto (Flesch Reading Ease)",
+        "simple": "Qué tan fácil es leer el texto (índice Szigriszt-Pazos / INFLESZ, para español)",
         "why": "Google prefiere contenido que todos puedan entender. Texto simple = mejor UX.",
         "how_to_use": "Usa frases cortas, palabras simples, evita jerga técnica innecesaria.",
-        "good": "Score 60-80 (Fácil)",
+        "good": "Score 65-80 (Fácil)",
         "bad": "Score menor a 40 (Difícil)"
     },
     "schema": {
@@ -333,442 +332,22 @@ def show_explainer(key, value=None, benchmark=None):
     """, unsafe_allow_html=True)
 
 # ==========================================
-# 🔑 API KEYS & CONFIGURACIÓN
+# 🔑 API KEY
 # ==========================================
-SERPER_API_KEY = st.secrets.get("SERPER_API_KEY", "cb2f958314203c51f8835f854b6a5038df46fb11")
-
-DOMINIOS_EXCLUIDOS = [
-    "youtube.com", "facebook.com", "instagram.com", "twitter.com", 
-    "tiktok.com", "pinterest", "linkedin", "amazon", "ebay"
-]
-
-H2_BLACKLIST = [
-    "suscríbete", "newsletter", "contacto", "ayuda", "política", "privacidad", 
-    "cookies", "menú", "login", "carrito"
-]
-
-FAQ_BLACKLIST = ["cookie", "política", "privacidad", "suscripción"]
-
-STOPWORDS = set([
-    "de", "la", "que", "el", "en", "y", "a", "los", "se", "del", "las", "un", 
-    "por", "con", "no", "una", "su", "para", "es", "al", "lo", "como", "mas", "más"
-])
+# La del secrets.toml tiene prioridad sobre la variable de entorno del núcleo
+seo_core.SERPER_API_KEY = st.secrets.get("SERPER_API_KEY", seo_core.SERPER_API_KEY)
 
 # ==========================================
 # 🧠 ESTADO DE SESIÓN
 # ==========================================
 if 'data_seo' not in st.session_state: st.session_state.data_seo = None
-if 'global_words' not in st.session_state: st.session_state.global_words = []
+if 'corpus' not in st.session_state: st.session_state.corpus = None
+if 'run_id' not in st.session_state: st.session_state.run_id = None
+if 'derivados' not in st.session_state: st.session_state.derivados = None
+if 'tabla' not in st.session_state: st.session_state.tabla = None
 if 'gap_analysis' not in st.session_state: st.session_state.gap_analysis = None
+if 'comparativa' not in st.session_state: st.session_state.comparativa = None
 if 'show_help' not in st.session_state: st.session_state.show_help = True
-
-# ==========================================
-# 🔍 FUNCIONES CORE MEJORADAS
-# ==========================================
-def get_serper_results(query, n_needed):
-    url = "https://google.serper.dev/search"
-    payload = {"q": query, "num": min(n_needed, 100), "gl": "es", "hl": "es"}
-    headers = {'X-API-KEY': SERPER_API_KEY, 'Content-Type': 'application/json'}
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        return response.json().get('organic', [])
-    except: return []
-
-def clean_h2s(soup_h2s):
-    valid_h2s = []
-    for h in soup_h2s:
-        text = h.get_text(" ", strip=True)
-        if len(text) < 5 or any(bad in text.lower() for bad in H2_BLACKLIST): continue
-        valid_h2s.append(text)
-    return valid_h2s
-
-def get_ngrams(words, n):
-    return [" ".join(words[i:i+n]) for i in range(len(words)-n+1)]
-
-def detectar_intencion(soup, text):
-    text_lower = text.lower()
-    title_lower = soup.title.string.lower() if soup.title else ""
-    transaccional = ["precio", "comprar", "venta", "oferta", "tienda"]
-    informacional = ["guía", "tutorial", "qué es", "cómo", "consejos"]
-    score_trans = sum(1 for w in transaccional if w in text_lower or w in title_lower)
-    score_info = sum(1 for w in informacional if w in text_lower or w in title_lower)
-    if score_trans > score_info: return "🛒 Transaccional"
-    if score_info > score_trans: return "📚 Informacional"
-    return "⚖️ Mixto"
-
-def analizar_enlaces(soup, url):
-    """MEJORADO: Analiza enlaces internos Y externos"""
-    try:
-        domain = urlparse(url).netloc
-        links = soup.find_all('a', href=True)
-        
-        internal = []
-        external = []
-        external_nofollow = 0
-        
-        for link in links:
-            href = link.get('href', '')
-            rel = link.get('rel', [])
-            
-            if domain in href or href.startswith('/'):
-                internal.append(href)
-            elif href.startswith('http'):
-                external.append(href)
-                if 'nofollow' in rel:
-                    external_nofollow += 1
-        
-        return {
-            "internal": len(internal),
-            "external": len(external),
-            "external_nofollow": external_nofollow,
-            "external_dofollow": len(external) - external_nofollow
-        }
-    except:
-        return {"internal": 0, "external": 0, "external_nofollow": 0, "external_dofollow": 0}
-
-def analizar_seo_onpage(soup, keyword):
-    """NUEVO: Análisis SEO on-page detallado"""
-    try:
-        title = soup.title.string.strip() if soup.title else ""
-        meta_desc = ""
-        meta_tag = soup.find("meta", attrs={"name": "description"})
-        if meta_tag and "content" in meta_tag.attrs:
-            meta_desc = meta_tag["content"]
-        
-        # Longitudes
-        title_length = len(title)
-        meta_length = len(meta_desc)
-        
-        # Keyword en lugares estratégicos
-        kw_in_title = keyword.lower() in title.lower()
-        kw_in_meta = keyword.lower() in meta_desc.lower()
-        kw_in_url = keyword.lower() in soup.find('link', rel='canonical')['href'].lower() if soup.find('link', rel='canonical') else False
-        
-        # H1 con keyword
-        h1s = soup.find_all('h1')
-        kw_in_h1 = any(keyword.lower() in h.get_text().lower() for h in h1s)
-        
-        # Uso de negritas/strong en keyword
-        strongs = soup.find_all(['strong', 'b'])
-        kw_in_strong = any(keyword.lower() in s.get_text().lower() for s in strongs)
-        
-        return {
-            "title_length": title_length,
-            "meta_length": meta_length,
-            "kw_in_title": kw_in_title,
-            "kw_in_meta": kw_in_meta,
-            "kw_in_url": kw_in_url,
-            "kw_in_h1": kw_in_h1,
-            "kw_in_strong": kw_in_strong
-        }
-    except:
-        return {
-            "title_length": 0, "meta_length": 0,
-            "kw_in_title": False, "kw_in_meta": False,
-            "kw_in_url": False, "kw_in_h1": False, "kw_in_strong": False
-        }
-
-def detectar_schema_markup(soup):
-    schemas = []
-    scripts = soup.find_all('script', type='application/ld+json')
-    for script in scripts:
-        try:
-            data = json.loads(script.string)
-            if isinstance(data, dict) and '@type' in data:
-                schemas.append(data['@type'])
-            elif isinstance(data, list):
-                for item in data:
-                    if isinstance(item, dict) and '@type' in item:
-                        schemas.append(item['@type'])
-        except: pass
-    return list(set(schemas))
-
-def analizar_media_richness(soup):
-    imagenes = len(soup.find_all('img'))
-    videos = len(soup.find_all(['video', 'iframe']))
-    
-    # Contar imágenes CON alt text
-    imgs_with_alt = len([img for img in soup.find_all('img') if img.get('alt')])
-    
-    return {
-        "images": imagenes,
-        "videos": videos,
-        "total": imagenes + videos,
-        "images_with_alt": imgs_with_alt,
-        "alt_ratio": (imgs_with_alt / imagenes * 100) if imagenes > 0 else 0
-    }
-
-def calcular_readability(text):
-    try:
-        score = flesch_reading_ease(text)
-        if score >= 80: return f"✅ Muy fácil ({score:.0f})"
-        elif score >= 60: return f"👍 Fácil ({score:.0f})"
-        elif score >= 40: return f"⚠️ Medio ({score:.0f})"
-        else: return f"❌ Difícil ({score:.0f})"
-    except: return "N/A"
-
-def estimar_domain_authority(url):
-    domain = urlparse(url).netloc
-    score = 50
-    if domain.endswith('.edu'): score += 20
-    elif domain.endswith('.gov'): score += 25
-    elif domain.endswith('.org'): score += 10
-    if domain.count('.') > 1: score -= 10
-    if len(domain) < 15: score += 5
-    return min(max(score, 0), 100)
-
-def analyze_url_final(url, target_kw, snippet_serp):
-    """ANÁLISIS COMPLETO MEJORADO"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml'
-    }
-    try:
-        downloaded = trafilatura.fetch_url(url)
-        main_text = None
-        if downloaded:
-            main_text = trafilatura.extract(downloaded, include_comments=False)
-        
-        soup = None
-        if not main_text:
-            res = requests.get(url, timeout=12, headers=headers, verify=False)
-            if res.status_code in [403, 429, 503]: 
-                return {"error": f"Bloqueo ({res.status_code})"}
-            soup = BeautifulSoup(res.text, 'html.parser')
-            for tag in soup(["script", "style", "nav", "footer", "header", "aside", "form"]): 
-                tag.decompose()
-            main_text = soup.get_text(separator=' ', strip=True)
-        else:
-            soup = BeautifulSoup(downloaded, 'html.parser')
-        
-        if len(main_text) < 100: 
-            return {"error": "Contenido insuficiente"}
-        
-        title = soup.title.string.strip() if soup.title else "N/A"
-        if title == "N/A" or len(title) < 3: 
-            return {"error": "Título no detectado"}
-        
-        meta_tag = soup.find("meta", attrs={"name": "description"})
-        meta_desc = meta_tag["content"] if meta_tag else snippet_serp
-        
-        h1s = [h.get_text(" ", strip=True) for h in soup.find_all('h1')]
-        h2s_clean = clean_h2s(soup.find_all('h2'))
-        
-        clean_words = [w for w in re.sub(r'[^\w\s]', '', main_text.lower()).split() 
-                      if w not in STOPWORDS and len(w) > 2]
-        
-        # ANÁLISIS MEJORADO
-        enlaces = analizar_enlaces(soup, url)
-        seo_onpage = analizar_seo_onpage(soup, target_kw)
-        schemas = detectar_schema_markup(soup)
-        media = analizar_media_richness(soup)
-        readability = calcular_readability(main_text)
-        da_proxy = estimar_domain_authority(url)
-        
-        return {
-            "title": title,
-            "meta_desc": meta_desc,
-            "h1": h1s,
-            "h2": h2s_clean,
-            "word_count": len(main_text.split()),
-            "kw_density": len(re.findall(rf'\b{re.escape(target_kw)}\b', main_text, re.IGNORECASE)),
-            "all_words": clean_words,
-            "intencion": detectar_intencion(soup, main_text),
-            "enlaces": enlaces,
-            "seo_onpage": seo_onpage,
-            "schemas": schemas,
-            "media": media,
-            "readability": readability,
-            "da_proxy": da_proxy,
-            "full_text": main_text
-        }
-    except Exception as e:
-        return {"error": str(e)}
-
-def calcular_competitor_score(item, benchmarks):
-    """
-    Calcula un score 0-100 para cada competidor basado en múltiples factores
-    """
-    scores = {}
-    
-    # 1. Word Count Score (20 puntos)
-    word_count = item.get('Palabras', 0)
-    word_benchmark = benchmarks['word_avg']
-    if word_count >= word_benchmark * 1.2:
-        scores['words'] = 20
-    elif word_count >= word_benchmark:
-        scores['words'] = 15
-    elif word_count >= word_benchmark * 0.8:
-        scores['words'] = 10
-    else:
-        scores['words'] = 5
-    
-    # 2. H2 Structure Score (15 puntos)
-    h2_count = len(item.get('H2_list', item.get('h2', [])))
-    h2_benchmark = benchmarks['h2_avg']
-    if h2_count >= h2_benchmark * 1.2:
-        scores['h2s'] = 15
-    elif h2_count >= h2_benchmark:
-        scores['h2s'] = 12
-    elif h2_count >= h2_benchmark * 0.8:
-        scores['h2s'] = 8
-    else:
-        scores['h2s'] = 4
-    
-    # 3. Internal Links Score (15 puntos)
-    enlaces = item.get('Enlaces', item.get('enlaces', {}))
-    internal = enlaces.get('internal', 0) if isinstance(enlaces, dict) else 0
-    internal_benchmark = benchmarks.get('internal_links_avg', 20)
-    if internal >= internal_benchmark * 1.2:
-        scores['internal_links'] = 15
-    elif internal >= internal_benchmark:
-        scores['internal_links'] = 12
-    elif internal >= internal_benchmark * 0.8:
-        scores['internal_links'] = 8
-    else:
-        scores['internal_links'] = 4
-    
-    # 4. External Links Score (10 puntos)
-    external = enlaces.get('external', 0) if isinstance(enlaces, dict) else 0
-    external_benchmark = benchmarks.get('external_links_avg', 5)
-    if external >= external_benchmark:
-        scores['external_links'] = 10
-    elif external >= external_benchmark * 0.7:
-        scores['external_links'] = 7
-    else:
-        scores['external_links'] = 4
-    
-    # 5. Media Richness Score (10 puntos)
-    media = item.get('Media', item.get('media', {}))
-    media_total = media.get('total', 0) if isinstance(media, dict) else 0
-    media_benchmark = benchmarks['media_avg']
-    if media_total >= media_benchmark * 1.2:
-        scores['media'] = 10
-    elif media_total >= media_benchmark:
-        scores['media'] = 8
-    elif media_total >= media_benchmark * 0.8:
-        scores['media'] = 5
-    else:
-        scores['media'] = 3
-    
-    # 6. Domain Authority Score (15 puntos)
-    da = item.get('DA_Proxy', 0)
-    if da >= 70:
-        scores['da'] = 15
-    elif da >= 50:
-        scores['da'] = 12
-    elif da >= 30:
-        scores['da'] = 8
-    else:
-        scores['da'] = 5
-    
-    # 7. SEO On-Page Score (10 puntos)
-    seo = item.get('SEO_Onpage', item.get('seo_onpage', {}))
-    if isinstance(seo, dict):
-        seo_points = 0
-        if seo.get('kw_in_title'): seo_points += 3
-        if seo.get('kw_in_meta'): seo_points += 2
-        if seo.get('kw_in_h1'): seo_points += 3
-        if seo.get('kw_in_strong'): seo_points += 2
-        scores['seo_onpage'] = seo_points
-    else:
-        scores['seo_onpage'] = 0
-    
-    # 8. Schema Markup Score (5 puntos)
-    schemas = item.get('Schemas', item.get('schemas', []))
-    if isinstance(schemas, list) and len(schemas) > 0:
-        scores['schema'] = 5
-    else:
-        scores['schema'] = 0
-    
-    # Score total
-    total_score = sum(scores.values())
-    
-    return {
-        'total': total_score,
-        'breakdown': scores,
-        'grade': 'A' if total_score >= 85 else 'B' if total_score >= 70 else 'C' if total_score >= 50 else 'D'
-    }
-
-def get_score_color(score):
-    """Retorna color según score"""
-    if score >= 85:
-        return "🟢", "#10b981"
-    elif score >= 70:
-        return "🟡", "#f59e0b"
-    else:
-        return "🔴", "#ef4444"
-
-def calcular_gap_analysis(data_list, keyword):
-    all_h2s = []
-    for item in data_list:
-        h2_list = item.get('H2_list', item.get('h2', []))
-        all_h2s.extend(h2_list)
-    h2_counter = Counter([h.lower() for h in all_h2s])
-    threshold = len(data_list) * 0.5
-    h2s_comunes = {h: count for h, count in h2_counter.items() if count >= threshold}
-    
-    all_words = []
-    for item in data_list:
-        all_words.extend(item.get('all_words', []))
-    word_counter = Counter(all_words)
-    
-    # Calcular promedios con manejo seguro de diccionarios
-    def safe_get_enlaces(item, key):
-        enlaces = item.get('Enlaces', item.get('enlaces', {}))
-        return enlaces.get(key, 0) if isinstance(enlaces, dict) else 0
-    
-    def safe_get_media(item, key):
-        media = item.get('Media', item.get('media', {}))
-        return media.get(key, 0) if isinstance(media, dict) else 0
-    
-    return {
-        "h2s_criticos": h2s_comunes,
-        "palabras_clave_secundarias": word_counter.most_common(30),
-        "coverage_benchmark": {
-            "h2_avg": np.mean([len(item.get('H2_list', item.get('h2', []))) for item in data_list]),
-            "word_avg": np.mean([item.get('Palabras', item.get('word_count', 0)) for item in data_list]),
-            "media_avg": np.mean([safe_get_media(item, 'total') for item in data_list]),
-            "internal_links_avg": np.mean([safe_get_enlaces(item, 'internal') for item in data_list]),
-            "external_links_avg": np.mean([safe_get_enlaces(item, 'external') for item in data_list])
-        }
-    }
-
-def realizar_clustering(data_list):
-    """Agrupa URLs por similitud semántica"""
-    if len(data_list) < 3:
-        return None
-    
-    corpus = []
-    urls = []
-    for item in data_list:
-        h2_list = item.get('H2_list', item.get('h2', []))
-        words = item.get('all_words', [])
-        text = " ".join(h2_list) + " " + " ".join(words[:100])
-        corpus.append(text)
-        urls.append(item.get('URL', ''))
-    
-    try:
-        vectorizer = TfidfVectorizer(max_features=50, stop_words=list(STOPWORDS))
-        X = vectorizer.fit_transform(corpus)
-        
-        n_clusters = min(3, len(data_list))
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        clusters = kmeans.fit_predict(X)
-        
-        cluster_groups = {}
-        for idx, cluster_id in enumerate(clusters):
-            if cluster_id not in cluster_groups:
-                cluster_groups[cluster_id] = []
-            cluster_groups[cluster_id].append({
-                "url": urls[idx],
-                "title": data_list[idx].get('Título', data_list[idx].get('title', 'N/A'))
-            })
-        
-        return cluster_groups
-    except:
-        return None
-
 # ==========================================
 # 🎨 SIDEBAR
 # ==========================================
@@ -784,7 +363,15 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("#### 🎯 Configuración")
     keyword = st.text_input("Keyword:", value="que es el repep")
+    variantes_txt = st.text_input("Variantes (opcional):", value="",
+                                  help="Separadas por comas; cuentan como menciones de la keyword")
+    variantes = [v.strip() for v in variantes_txt.split(",") if v.strip()]
+    mercados = st.multiselect("Mercados:", list(MERCADOS), default=["es-es"],
+                              format_func=lambda m: MERCADOS[m][2],
+                              help="El primero es el principal; con varios se comparan lado a lado") or ["es-es"]
     num_target = st.slider("Competidores:", 3, 10, 5)
+    max_conexiones = st.slider("Descargas simultáneas:", 1, 16, MAX_CONEXIONES,
+                               help="Número de páginas que se descargan en paralelo")
     
     st.markdown("---")
     st.markdown("#### 🎓 Modo Aprendizaje")
@@ -796,7 +383,20 @@ with st.sidebar:
     
     if st.button("🗑️ Limpiar", use_container_width=True):
         st.session_state.data_seo = None
+        st.session_state.comparativa = None
         st.rerun()
+    
+    with st.expander("📦 Modo lote"):
+        archivo_lote = st.file_uploader("Keywords (TXT o CSV):", type=["txt", "csv"],
+                                        help="Una keyword por línea (CSV: primera columna)")
+        lote_dir = st.text_input("Carpeta de resultados:", value=LOTE_DIR)
+        lote_paralelo = st.slider("Keywords en paralelo:", 1, 16, LOTE_KEYWORDS_PARALELO)
+        lote_reanudar = st.checkbox("Saltar keywords ya exportadas", value=True)
+        lote_button = st.button("📦 ANALIZAR LOTE", use_container_width=True, disabled=archivo_lote is None)
+    
+    serp_stats = get_serp_cache().stats
+    st.caption(f"💾 Caché SERP: {serp_stats['hits']} aciertos · {serp_stats['misses']} fallos · "
+               f"{serp_stats['api_calls_saved']} llamadas API ahorradas")
 
 # ==========================================
 # 🎯 HEADER
@@ -812,68 +412,279 @@ st.markdown("""
 # 🎯 EJECUCIÓN
 # ==========================================
 if analyze_button and keyword:
+    gl, hl, _ = MERCADOS[mercados[0]]
+    otros_mercados = None
+    if len(mercados) > 1:
+        # El resto de mercados corre en segundo plano mientras el principal se pinta en vivo
+        fondo = ThreadPoolExecutor(max_workers=1)
+        otros_mercados = fondo.submit(analizar_mercados, keyword, mercados[1:], num_target,
+                                      max_conexiones, variantes)
+        fondo.shutdown(wait=False)
+    
     with st.status("🔄 Analizando...", expanded=True) as status:
-        raw_results = get_serper_results(keyword, num_target + 40)
+        raw_results = get_serper_results(keyword, num_target, gl=gl, hl=hl)
+        corpus = CorpusStore()
+        acumulado = GapAcumulado(corpus)
+        filas = {}  # índice SERP -> fila, según van llegando
+        originales = {}
         final_data = []
-        global_words = []
-        count_valid = 0
+        st.session_state.comparativa = None
         
         if raw_results:
             progress_bar = st.progress(0)
-            for res in raw_results:
-                if count_valid >= num_target: break
-                url = res['link']
-                if any(bad in url for bad in DOMINIOS_EXCLUIDOS): continue
+            vista_benchmarks = st.empty()
+            vista_tabla = st.empty()
+            
+            def on_resultado(idx, res, data, n_validos):
+                status.update(label=f"🔍 {min(n_validos, num_target)}/{num_target}: {res.get('title', '')[:30]}...")
+                progress_bar.progress(min(n_validos / num_target, 1.0))
+                if not data or "error" in data:
+                    return
                 
-                status.update(label=f"🔍 #{count_valid+1}: {res.get('title', '')[:30]}...")
-                data = analyze_url_final(url, keyword, res.get('snippet', ''))
+                # Cada competidor entra en los acumulados y se muestra al instante
+                fila = construir_fila(res, data, corpus)
+                filas[idx] = fila
+                originales[idx] = data
+                acumulado.add(fila)
+                bench = acumulado.benchmarks()
+                vista_benchmarks.caption(
+                    f"📊 En vivo ({acumulado.n}): {bench['word_avg']:.0f} palabras · {bench['h2_avg']:.1f} H2 · "
+                    f"{bench['internal_links_avg']:.1f} links int. · {bench['media_avg']:.1f} media"
+                )
                 
-                if data and "error" not in data:
-                    global_words.extend(data['all_words'])
-                    final_data.append({
-                        "Pos": count_valid + 1,
-                        "URL": url,
-                        "Título": data['title'],
-                        "Meta Desc": data['meta_desc'],
-                        "Palabras": data['word_count'],
-                        "Intención": data['intencion'],
-                        "Menciones KW": data['kw_density'],
-                        "H1_list": data.get('h1', []),
-                        "H2_list": data.get('h2', []),
-                        "Contenido": data.get('full_text', '')[:1000],
-                        "Enlaces": data.get('enlaces', {}),
-                        "SEO_Onpage": data.get('seo_onpage', {}),
-                        "Schemas": data.get('schemas', []),
-                        "Media": data.get('media', {}),
-                        "Readability": data.get('readability', 'N/A'),
-                        "DA_Proxy": data.get('da_proxy', 0),
-                        **data
-                    })
-                    count_valid += 1
-                    progress_bar.progress(count_valid / num_target)
+                provisional = [filas[i] for i in sorted(filas)][:num_target]
+                for pos, f in enumerate(provisional, 1):
+                    f['Pos'] = pos  # provisional: puede moverse si llega alguien por delante
+                tabla_vivo = construir_tabla_competidores(provisional)
+                scores = calcular_scores(matriz_desde_tabla(tabla_vivo), bench)
+                vista_tabla.dataframe(pd.DataFrame({
+                    'Pos': tabla_vivo['Pos'],
+                    'Score': scores['total'],
+                    'Título': tabla_vivo['Título'],
+                    'Palabras': tabla_vivo['Palabras'],
+                    'H2s': tabla_vivo['Num_H2s']
+                }), use_container_width=True, hide_index=True)
+            
+            # Keyword + variantes compiladas una vez para todas las páginas
+            matcher = KeywordMatcher([keyword, *variantes])
+            resultados = analizar_competidores(raw_results, matcher, num_target,
+                                               max_workers=max_conexiones, on_resultado=on_resultado)
+            
+            # Fijar Pos en orden SERP y descartar lo que quedó fuera de la cuota
+            confirmados = {id(data) for _, data in resultados}
+            final_data = []
+            for idx in sorted(filas):
+                fila = filas[idx]
+                if id(originales[idx]) not in confirmados:
+                    acumulado.remove(fila)
+                    corpus.remove(fila['doc_id'])
+                    continue
+                fila['Pos'] = len(final_data) + 1
+                final_data.append(fila)
             
             if final_data:
                 st.session_state.data_seo = final_data
-                st.session_state.global_words = global_words
-                st.session_state.gap_analysis = calcular_gap_analysis(final_data, keyword)
-                st.session_state.clusters = realizar_clustering(final_data)
-                status.update(label="✅ Completado", state="complete")
-                st.balloons()
+                st.session_state.run_id = uuid.uuid4().hex
+                st.session_state.run_keyword = keyword
+                st.session_state.run_mercado = (gl, hl)
+                st.session_state.corpus = corpus
+                st.session_state.tabla = construir_tabla_competidores(final_data)
+                st.session_state.gap_analysis = acumulado.resultado()
+                # Al final: DF del mercado, términos distintivos y clustering (solo transform)
+                idf = get_idf_store(gl, hl)
+                registrar_en_idf(final_data, corpus, idf)
+                st.session_state.gap_analysis['palabras_distintivas'] = palabras_distintivas(final_data, corpus, idf)
+                st.session_state.clusters = realizar_clustering(final_data, corpus, idf)
+        
+        # La comparativa se monta aunque el mercado principal no haya dado resultados
+        if otros_mercados is not None:
+            status.update(label="🌍 Esperando al resto de mercados...")
+            if final_data:
+                principal = completar_salida(salida_vacia(keyword, gl, hl), final_data,
+                                             st.session_state.gap_analysis, st.session_state.clusters)
+            else:
+                principal = {**salida_vacia(keyword, gl, hl),
+                             "estado": "sin resultados" if raw_results else "sin SERP"}
+                st.session_state.data_seo = None
+            st.session_state.comparativa = comparar_mercados({mercados[0]: principal,
+                                                              **otros_mercados.result()})
+        
+        if final_data:
+            status.update(label="✅ Completado", state="complete")
+            st.balloons()
+        elif st.session_state.comparativa:
+            status.update(label=f"⚠️ Sin resultados en {MERCADOS[mercados[0]][2]}", state="error")
+
+if lote_button and archivo_lote is not None:
+    keywords_lote = leer_keywords(archivo_lote.getvalue(), archivo_lote.name)
+    with st.status(f"📦 Lote de {len(keywords_lote)} keywords...", expanded=True) as status:
+        progress_bar = st.progress(0)
+        vista_lote = st.empty()
+        inicio = time.time()
+        
+        # Solo se repinta al terminar cada keyword: la UI no frena las descargas
+        def on_keyword(r, hechas, total):
+            progress_bar.progress(hechas / max(total, 1))
+            status.update(label=f"📦 {hechas}/{total} · {r['keyword'][:40]} ({r['estado']}) · "
+                                f"{time.time() - inicio:.0f}s")
+        
+        resumen_lote = analizar_lote(keywords_lote, num_target, out_dir=lote_dir,
+                                     max_conexiones=max_conexiones, keywords_paralelo=lote_paralelo,
+                                     reanudar=lote_reanudar, on_keyword=on_keyword)
+        vista_lote.dataframe(pd.DataFrame(resumen_lote), use_container_width=True, hide_index=True)
+        ok = sum(1 for r in resumen_lote if r['estado'] == 'ok')
+        status.update(label=f"✅ Lote completado: {ok}/{len(keywords_lote)} keywords en {lote_dir}",
+                      state="complete")
+
+# ==========================================
+# 🧮 DERIVADOS MEMOIZADOS POR EJECUCIÓN
+# ==========================================
+EXPORT_COLUMNAS = ['Pos', 'URL', 'Título', 'Meta Desc', 'Palabras', 'Menciones KW', 
+                   'Intención', 'DA_Proxy', 'Readability', 'Readability_Score',
+                   'Enlaces_Internos', 'Enlaces_Externos', 'Imagenes', 'Videos', 'Schemas', 'Num_H2s']
+
+def obtener_derivados():
+    """
+    Toda la analítica posterior al análisis (DataFrames, scores, gráficos, exportaciones),
+    calculada UNA vez por run_id. Los reruns por widgets solo renderizan este memo.
+    """
+    memo = st.session_state.derivados
+    if memo and memo['run_id'] == st.session_state.run_id:
+        return memo
+    
+    data = st.session_state.data_seo
+    tabla = st.session_state.tabla
+    gap = st.session_state.gap_analysis
+    corpus = st.session_state.corpus
+    keyword_run = st.session_state.get('run_keyword', '')
+    intenciones = tabla['Intención'].mode()
+    
+    memo = {
+        "run_id": st.session_state.run_id,
+        "word_avg": int(tabla['Palabras'].mean()),
+        "intencion": intenciones[0] if not intenciones.empty else "N/A",
+        "internal_avg": int(tabla['Enlaces_Internos'].mean()),
+        "media_avg": tabla['Media_Total'].mean(),
+        "da_avg": int(tabla['DA_Proxy'].mean()),
+        "total_words": int(tabla['Palabras'].sum()),
+        "data_sorted": [],
+        "score_df": None,
+        "h2_df": None,
+        "gap_text": None,
+        "bigram_chart": None,
+        "ngram_tables": {},
+        "detalle": tabla.to_dict('records'),
+        "file_stamp": f"{keyword_run.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}",
+        "analizado": datetime.now().strftime('%Y-%m-%d %H:%M'),
+        "total_h2s": int(tabla['Num_H2s'].sum()),
+        "total_schemas": int(tabla['Num_Schemas'].sum()),
+    }
+    
+    if gap:
+        # Calcular score para todos los competidores de una vez
+        scores = calcular_scores(matriz_desde_tabla(tabla), gap['coverage_benchmark'])
+        orden = np.argsort(-scores['total'], kind='stable')[:10]  # Top 10
+        
+        memo['data_sorted'] = [
+            {'Pos': int(tabla['Pos'].iat[i]), 'score_data': score_de_fila(scores, i)} for i in orden
+        ]
+        titulos = tabla['Título'].to_numpy()[orden]
+        breakdown = {factor: puntos[orden] for factor, puntos in scores['breakdown'].items()}
+        memo['score_df'] = pd.DataFrame({
+            'Pos': ['#' + str(p) for p in tabla['Pos'].to_numpy()[orden]],
+            'Score': scores['total'][orden],
+            'Grade': scores['grade'][orden],
+            '📝 Palabras': breakdown['words'],
+            '📑 H2s': breakdown['h2s'],
+            '🔗 Links Int': breakdown['internal_links'],
+            '🌐 Links Ext': breakdown['external_links'],
+            '🖼️ Media': breakdown['media'],
+            '📊 DA': breakdown['da'],
+            '✅ SEO': breakdown['seo_onpage'],
+            '🏗️ Schema': breakdown['schema'],
+            'Título': [t[:50] + '...' if len(t) > 50 else t for t in titulos]
+        })
+        
+        if gap['h2s_criticos']:
+            variantes = gap.get('h2_variantes', {})
+            memo['h2_df'] = pd.DataFrame(
+                [(h, count, " · ".join(v for v in variantes.get(h, []) if v != h))
+                 for h, count in gap['h2s_criticos'].items()],
+                columns=['Sección H2', 'Aparece en X competidores', 'Variantes']
+            ).sort_values('Aparece en X competidores', ascending=False, kind='stable')
+        memo['gap_text'] = construir_gap_report(gap, keyword_run, len(data))
+    
+    top_bigrams = corpus.ngrams.top(2, 12, corpus.palabras)
+    if top_bigrams:
+        memo['bigram_chart'] = pd.DataFrame([(frase, count) for frase, count, _ in top_bigrams], 
+                                            columns=['Frase', 'Frecuencia']).set_index('Frase')
+        memo['ngram_tables'] = {
+            n: pd.DataFrame(corpus.ngrams.top(n, 20, corpus.palabras),
+                            columns=['Frase', 'Frecuencia', 'Competidores'])
+            for n in (2, 3)
+        }
+    
+    # Exportación: columnas ya planas, sin apply por fila
+    export_df = tabla[EXPORT_COLUMNAS]
+    memo['export_df'] = export_df
+    memo['export_csv'] = export_df.to_csv(index=False).encode('utf-8')
+    
+    st.session_state.derivados = memo
+    return memo
+
+def mostrar_comparativa(comparativa):
+    """Pestaña 🌍 Mercados: la misma keyword en cada mercado, lado a lado"""
+    st.markdown("### 🌍 Comparativa entre Mercados")
+    nombres = {m: MERCADOS[m][2] for m in comparativa['mercados']}
+
+    if st.session_state.show_help:
+        st.info(f"💡 **Guía rápida:** La misma keyword en cada mercado. Las URLs compartidas compiten en todos; "
+                f"las exclusivas son competencia local. Las diferencias se miden frente a {nombres[comparativa['mercados'][0]]}.")
+
+    for m, estado in comparativa['estados'].items():
+        if estado != "ok":
+            st.warning(f"{nombres[m]}: {estado}")
+
+    cols = st.columns(len(comparativa['mercados']) + 1)
+    cols[0].metric("🤝 Compartidas", len(comparativa['compartidas']))
+    for col, m in zip(cols[1:], comparativa['mercados']):
+        col.metric(f"📍 Solo {nombres[m]}", len(comparativa['exclusivas'][m]))
+
+    st.markdown("#### 🏁 Posiciones por Mercado")
+    st.dataframe(pd.DataFrame(comparativa['posiciones']).rename(columns=nombres),
+                 use_container_width=True, hide_index=True)
+
+    st.markdown("#### 📊 Benchmarks por Mercado")
+    metricas = {'word_avg': "Palabras", 'h2_avg': "H2s", 'internal_links_avg': "Links internos",
+                'external_links_avg': "Links externos", 'media_avg': "Media"}
+    bench_df = pd.DataFrame({nombres[m]: {metricas[k]: round(v, 1) for k, v in b.items() if k in metricas}
+                             for m, b in comparativa['benchmarks'].items()}).reindex(list(metricas.values()))
+    for m, dif in comparativa['diferencias'].items():
+        bench_df[f"Δ% {nombres[m]}"] = pd.Series({metricas[k]: round(v, 1) for k, v in dif.items()
+                                                 if k in metricas})
+    st.dataframe(bench_df, use_container_width=True)
+
+    if comparativa['h2s_compartidos']:
+        st.markdown("#### 🔥 H2 Críticos en Todos los Mercados")
+        for h2 in comparativa['h2s_compartidos']:
+            st.markdown(f"• {h2}")
 
 # ==========================================
 # 📊 RESULTADOS CON EXPLICACIONES
 # ==========================================
 if st.session_state.data_seo:
     data = st.session_state.data_seo
-    df = pd.DataFrame(data)
+    derivados = obtener_derivados()
     
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+    comparativa = st.session_state.comparativa
+    pestanas = st.tabs([
         "📊 Overview (Con Guía)", 
         "🎯 Gap Analysis (Qué Hacer)",
         "🧬 Topic Clustering",
         "📋 Detalle Competidores",
         "💾 Exportar Datos"
-    ])
+    ] + (["🌍 Mercados"] if comparativa else []))
+    tab1, tab2, tab3, tab4, tab5 = pestanas[:5]
     
     with tab1:
         st.markdown("### 📊 Métricas Principales")
@@ -883,27 +694,24 @@ if st.session_state.data_seo:
         
         c1, c2, c3, c4, c5 = st.columns(5)
         
-        word_avg = int(df['Palabras'].mean())
-        c1.metric("📝 Palabras Promedio", word_avg)
+        c1.metric("📝 Palabras Promedio", derivados['word_avg'])
         if st.session_state.show_help:
             with c1:
                 show_explainer("word_count")
         
-        c2.metric("🎯 Intención", df['Intención'].mode()[0] if not df['Intención'].empty else "N/A")
+        c2.metric("🎯 Intención", derivados['intencion'])
         
-        internal_avg = int(df.apply(lambda x: x.get('Enlaces', x.get('enlaces', {})).get('internal', 0) if isinstance(x.get('Enlaces', x.get('enlaces', {})), dict) else 0, axis=1).mean())
-        c3.metric("🔗 Links Internos", internal_avg)
+        c3.metric("🔗 Links Internos", derivados['internal_avg'])
         if st.session_state.show_help:
             with c3:
                 show_explainer("internal_links")
         
-        media_avg = df.apply(lambda x: x.get('Media', x.get('media', {})).get('total', 0) if isinstance(x.get('Media', x.get('media', {})), dict) else 0, axis=1).mean()
-        c4.metric("🖼️ Imágenes/Videos", f"{media_avg:.1f}")
+        c4.metric("🖼️ Imágenes/Videos", f"{derivados['media_avg']:.1f}")
         if st.session_state.show_help:
             with c4:
                 show_explainer("images")
         
-        c5.metric("📊 DA Promedio", int(df['DA_Proxy'].mean()))
+        c5.metric("📊 DA Promedio", derivados['da_avg'])
         if st.session_state.show_help:
             with c5:
                 show_explainer("da_proxy")
@@ -929,37 +737,8 @@ if st.session_state.data_seo:
         
         # Calcular scores si gap_analysis existe
         if st.session_state.gap_analysis:
-            benchmarks = st.session_state.gap_analysis['coverage_benchmark']
-            
-            # Calcular score para cada competidor
-            for item in data:
-                item['score_data'] = calcular_competitor_score(item, benchmarks)
-            
-            # Ordenar por score
-            data_sorted = sorted(data, key=lambda x: x['score_data']['total'], reverse=True)
-            
-            # Crear DataFrame para visualización
-            score_rows = []
-            for item in data_sorted[:10]:  # Top 10
-                score = item['score_data']
-                emoji, color = get_score_color(score['total'])
-                
-                score_rows.append({
-                    'Pos': f"#{item['Pos']}",
-                    'Score': score['total'],
-                    'Grade': score['grade'],
-                    '📝 Palabras': score['breakdown']['words'],
-                    '📑 H2s': score['breakdown']['h2s'],
-                    '🔗 Links Int': score['breakdown']['internal_links'],
-                    '🌐 Links Ext': score['breakdown']['external_links'],
-                    '🖼️ Media': score['breakdown']['media'],
-                    '📊 DA': score['breakdown']['da'],
-                    '✅ SEO': score['breakdown']['seo_onpage'],
-                    '🏗️ Schema': score['breakdown']['schema'],
-                    'Título': item['Título'][:50] + '...' if len(item['Título']) > 50 else item['Título']
-                })
-            
-            score_df = pd.DataFrame(score_rows)
+            data_sorted = derivados['data_sorted']
+            score_df = derivados['score_df']
             
             # Mostrar top 3
             col1, col2, col3 = st.columns(3)
@@ -1076,11 +855,18 @@ if st.session_state.data_seo:
             </div>
             """, unsafe_allow_html=True)
         
-        bigrams = get_ngrams(st.session_state.global_words, 2)
-        if bigrams:
-            chart_data = pd.DataFrame(Counter(bigrams).most_common(12), 
-                                     columns=['Frase', 'Frecuencia']).set_index('Frase')
-            st.bar_chart(chart_data, color="#6366f1")
+        if derivados['bigram_chart'] is not None:
+            st.bar_chart(derivados['bigram_chart'], color="#6366f1")
+            
+            with st.expander("🔍 Ver frases de 2 y 3 palabras por nº de competidores"):
+                for n in (2, 3):
+                    st.dataframe(derivados['ngram_tables'][n], use_container_width=True)
+        
+        distintivas = (st.session_state.gap_analysis or {}).get('palabras_distintivas')
+        if distintivas:
+            with st.expander("🧬 Términos distintivos de esta SERP (TF-IDF frente al resto del mercado)"):
+                st.dataframe(pd.DataFrame(distintivas, columns=['Término', 'Peso TF-IDF']),
+                             use_container_width=True, hide_index=True)
     
     with tab2:
         st.markdown("### 🎯 Plan de Acción: Qué Debes Hacer")
@@ -1117,11 +903,7 @@ if st.session_state.data_seo:
                     </div>
                     """, unsafe_allow_html=True)
                 
-                h2_df = pd.DataFrame(
-                    [(h, count) for h, count in gap['h2s_criticos'].items()],
-                    columns=['Sección H2', 'Aparece en X competidores']
-                ).sort_values('Aparece en X competidores', ascending=False)
-                st.dataframe(h2_df, use_container_width=True)
+                st.dataframe(derivados['h2_df'], use_container_width=True)
                 
                 st.success("✅ **Acción:** Copia estas secciones H2 y escribe contenido original para cada una")
             else:
@@ -1143,10 +925,12 @@ if st.session_state.data_seo:
             </div>
             """, unsafe_allow_html=True)
         
-        # Calcular clustering si no existe
-        if not st.session_state.clusters and len(data) >= 3:
+        # Calcular clustering si no existe (un único intento por ejecución)
+        if not st.session_state.clusters and len(data) >= 3 and not derivados.get('clustering_intentado'):
+            derivados['clustering_intentado'] = True
             with st.spinner("🔄 Calculando clusters semánticos..."):
-                st.session_state.clusters = realizar_clustering(data)
+                st.session_state.clusters = realizar_clustering(data, st.session_state.corpus,
+                                                                get_idf_store(*st.session_state.run_mercado))
         
         if st.session_state.clusters:
             clusters = st.session_state.clusters
@@ -1198,59 +982,57 @@ if st.session_state.data_seo:
             st.warning("⚠️ Se necesitan al menos 3 competidores analizados para hacer clustering.")
         else:
             if st.button("🧬 Calcular Clustering Ahora"):
-                st.session_state.clusters = realizar_clustering(data)
+                st.session_state.clusters = realizar_clustering(data, st.session_state.corpus,
+                                                                get_idf_store(*st.session_state.run_mercado))
                 st.rerun()
     
     with tab4:
         st.markdown("### 📋 Análisis Detallado de Cada Competidor")
         
-        for item in data:
-            titulo_corto = (item['Título'][:70] + '..') if len(item['Título']) > 70 else item['Título']
+        for item, fila in zip(data, derivados['detalle']):
+            titulo_corto = (fila['Título'][:70] + '..') if len(fila['Título']) > 70 else fila['Título']
             
-            with st.expander(f"#{item['Pos']} | {titulo_corto}", expanded=False):
+            with st.expander(f"#{fila['Pos']} | {titulo_corto}", expanded=False):
                 
                 # Métricas principales
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
                     st.markdown("#### 📊 Métricas Básicas")
-                    st.markdown(f"**Palabras:** {item['Palabras']}")
-                    st.markdown(f"**Intención:** {item['Intención']}")
-                    st.markdown(f"**DA:** {item['DA_Proxy']}")
-                    st.markdown(f"**Legibilidad:** {item['Readability']}")
+                    st.markdown(f"**Palabras:** {fila['Palabras']}")
+                    st.markdown(f"**Intención:** {fila['Intención']}")
+                    st.markdown(f"**DA:** {fila['DA_Proxy']}")
+                    st.markdown(f"**Legibilidad:** {fila['Readability']}")
                 
                 with col2:
                     st.markdown("#### 🔗 Enlaces")
-                    enlaces = item.get('enlaces', {})
-                    st.markdown(f"**Internos:** {enlaces.get('internal', 0)}")
-                    st.markdown(f"**Externos:** {enlaces.get('external', 0)}")
-                    st.markdown(f"**Externos Dofollow:** {enlaces.get('external_dofollow', 0)}")
+                    st.markdown(f"**Internos:** {fila['Enlaces_Internos']}")
+                    st.markdown(f"**Externos:** {fila['Enlaces_Externos']}")
+                    st.markdown(f"**Externos Dofollow:** {fila['Externos_Dofollow']}")
                 
                 with col3:
                     st.markdown("#### 🖼️ Multimedia")
-                    media = item.get('media', {})
-                    st.markdown(f"**Imágenes:** {media.get('images', 0)}")
-                    st.markdown(f"**Videos:** {media.get('videos', 0)}")
-                    st.markdown(f"**Imágenes con ALT:** {media.get('images_with_alt', 0)}")
+                    st.markdown(f"**Imágenes:** {fila['Imagenes']}")
+                    st.markdown(f"**Videos:** {fila['Videos']}")
+                    st.markdown(f"**Imágenes con ALT:** {fila['Imagenes_Alt']}")
                 
                 # SEO On-Page
-                seo = item.get('SEO_Onpage', item.get('seo_onpage', {}))
-                if seo:
+                if fila['Tiene_SEO']:
                     st.markdown("#### ✅ SEO On-Page")
                     
                     checks = [
-                        ("Keyword en Título", seo.get('kw_in_title', False)),
-                        ("Keyword en Meta Description", seo.get('kw_in_meta', False)),
-                        ("Keyword en H1", seo.get('kw_in_h1', False)),
-                        ("Keyword en Negritas", seo.get('kw_in_strong', False))
+                        ("Keyword en Título", fila['kw_in_title']),
+                        ("Keyword en Meta Description", fila['kw_in_meta']),
+                        ("Keyword en H1", fila['kw_in_h1']),
+                        ("Keyword en Negritas", fila['kw_in_strong'])
                     ]
                     
                     for check_name, has_it in checks:
                         icon = "✅" if has_it else "❌"
                         st.markdown(f"{icon} {check_name}")
                     
-                    st.markdown(f"**Longitud Título:** {seo.get('title_length', 0)} caracteres")
-                    st.markdown(f"**Longitud Meta:** {seo.get('meta_length', 0)} caracteres")
+                    st.markdown(f"**Longitud Título:** {fila['title_length']} caracteres")
+                    st.markdown(f"**Longitud Meta:** {fila['meta_length']} caracteres")
                 
                 # H2s
                 h2_list = item.get('H2_list', item.get('h2', []))
@@ -1260,9 +1042,8 @@ if st.session_state.data_seo:
                         st.markdown(f"• {h2}")
                 
                 # Schemas
-                schemas = item.get('Schemas', item.get('schemas', []))
-                if schemas:
-                    st.markdown(f"#### 🏗️ Schemas: {', '.join(schemas)}")
+                if fila['Num_Schemas']:
+                    st.markdown(f"#### 🏗️ Schemas: {fila['Schemas']}")
     
     with tab5:
         st.markdown("### 💾 Exportar Análisis Completo")
@@ -1284,51 +1065,15 @@ if st.session_state.data_seo:
         st.markdown("#### 📊 Exportar Análisis Completo (CSV)")
         st.caption("Incluye: Posición, URL, Title, Meta, Palabras, Intención, DA, Enlaces, etc.")
         
-        # Preparar DataFrame para exportar
-        export_cols = ['Pos', 'URL', 'Título', 'Meta Desc', 'Palabras', 'Menciones KW', 
-                      'Intención', 'DA_Proxy', 'Readability']
-        
-        export_df = df[export_cols].copy()
-        
-        # Agregar columnas calculadas
-        export_df['Enlaces_Internos'] = df.apply(
-            lambda x: x.get('Enlaces', x.get('enlaces', {})).get('internal', 0) 
-            if isinstance(x.get('Enlaces', x.get('enlaces', {})), dict) else 0, 
-            axis=1
-        )
-        export_df['Enlaces_Externos'] = df.apply(
-            lambda x: x.get('Enlaces', x.get('enlaces', {})).get('external', 0) 
-            if isinstance(x.get('Enlaces', x.get('enlaces', {})), dict) else 0, 
-            axis=1
-        )
-        export_df['Imagenes'] = df.apply(
-            lambda x: x.get('Media', x.get('media', {})).get('images', 0) 
-            if isinstance(x.get('Media', x.get('media', {})), dict) else 0, 
-            axis=1
-        )
-        export_df['Videos'] = df.apply(
-            lambda x: x.get('Media', x.get('media', {})).get('videos', 0) 
-            if isinstance(x.get('Media', x.get('media', {})), dict) else 0, 
-            axis=1
-        )
-        export_df['Schemas'] = df.apply(
-            lambda x: ', '.join(x.get('Schemas', x.get('schemas', []))) 
-            if x.get('Schemas', x.get('schemas', [])) else 'None', 
-            axis=1
-        )
-        export_df['Num_H2s'] = df.apply(
-            lambda x: len(x.get('H2_list', x.get('h2', []))), 
-            axis=1
-        )
+        export_df = derivados['export_df']
         
         # Vista previa
         st.dataframe(export_df.head(), use_container_width=True)
         
-        csv = export_df.to_csv(index=False).encode('utf-8')
         st.download_button(
             "📥 Descargar Análisis Completo (CSV)",
-            csv,
-            f"SERP_Analysis_{keyword.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv",
+            derivados['export_csv'],
+            f"SERP_Analysis_{derivados['file_stamp']}.csv",
             "text/csv",
             type="primary",
             use_container_width=True
@@ -1340,95 +1085,15 @@ if st.session_state.data_seo:
         st.markdown("#### 🎯 Exportar Gap Analysis (TXT)")
         st.caption("Lista completa de H2s críticos y palabras clave para tu contenido")
         
-        if st.session_state.gap_analysis:
-            gap = st.session_state.gap_analysis
-            bench = gap['coverage_benchmark']
-            
-            gap_text = f"""
-========================================
-SERP X-RAY 360™ - GAP ANALYSIS REPORT
-========================================
-Keyword: {keyword}
-Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M')}
-Competidores analizados: {len(data)}
-
-========================================
-📊 BENCHMARKS OBLIGATORIOS
-========================================
-• Palabras mínimas: {int(bench['word_avg'] * 1.2)} palabras (promedio: {int(bench['word_avg'])})
-• H2s recomendados: {int(bench['h2_avg'])} secciones
-• Enlaces internos: {int(bench['internal_links_avg'])} links
-• Enlaces externos: {int(bench['external_links_avg'])} links
-• Imágenes/Videos: {int(bench['media_avg'])} elementos multimedia
-
-========================================
-🔴 H2S CRÍTICOS (Secciones Obligatorias)
-========================================
-Estas secciones aparecen en +50% de competidores.
-DEBES incluirlas en tu artículo:
-
-"""
-            if gap['h2s_criticos']:
-                for h2, count in sorted(gap['h2s_criticos'].items(), key=lambda x: x[1], reverse=True):
-                    gap_text += f"• {h2.title()} (aparece en {count} competidores)\n"
-            else:
-                gap_text += "• Sin H2s consistentes (cada competidor usa estructura diferente)\n"
-            
-            gap_text += f"""
-
-========================================
-📝 PALABRAS CLAVE SECUNDARIAS (Top 30)
-========================================
-Incluye estas palabras de forma natural en tu texto:
-
-"""
-            for word, count in gap['palabras_clave_secundarias'][:30]:
-                gap_text += f"• {word} ({count} menciones)\n"
-            
-            gap_text += f"""
-
-========================================
-✅ CHECKLIST DE CONTENIDO
-========================================
-Antes de publicar, verifica:
-
-[ ] Artículo tiene +{int(bench['word_avg'] * 1.2)} palabras
-[ ] Incluye TODOS los H2s críticos listados arriba
-[ ] Tiene {int(bench['h2_avg'])}+ secciones H2
-[ ] Contiene {int(bench['internal_links_avg'])}+ enlaces internos
-[ ] Cita {int(bench['external_links_avg'])}+ fuentes externas de autoridad
-[ ] Incluye {int(bench['media_avg'])}+ imágenes (todas con ALT text)
-[ ] Title tag tiene 50-60 caracteres
-[ ] Meta description tiene 150-160 caracteres
-[ ] Keyword principal en: Title, Meta, H1, URL
-[ ] Usa las palabras clave secundarias del listado
-[ ] Responde las preguntas frecuentes del sector
-[ ] Tiene Schema Markup (mínimo: Article)
-
-========================================
-🎯 ESTRATEGIA RECOMENDADA
-========================================
-"""
-            if bench['word_avg'] > 2000:
-                gap_text += "• Keyword COMPETITIVA: Necesitas contenido excepcional (+2500 palabras)\n"
-            else:
-                gap_text += "• Keyword MODERADA: Contenido sólido puede rankear (1800-2200 palabras)\n"
-            
-            gap_text += f"""• Supera el promedio en TODAS las métricas en un 20%
-• Cubre TODOS los H2s críticos identificados
-• Agrega valor único que los competidores NO tienen
-
-========================================
-Generado por SERP X-RAY 360™ PRO
-========================================
-"""
+        if derivados['gap_text']:
+            gap_text = derivados['gap_text']
             
             st.text_area("Vista previa:", gap_text, height=300)
             
             st.download_button(
                 "📥 Descargar Gap Analysis (TXT)",
                 gap_text.encode('utf-8'),
-                f"Gap_Analysis_{keyword.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.txt",
+                f"Gap_Analysis_{derivados['file_stamp']}.txt",
                 "text/plain",
                 use_container_width=True
             )
@@ -1442,15 +1107,14 @@ Generado por SERP X-RAY 360™ PRO
         
         with col1:
             st.metric("🌐 URLs Analizadas", len(data))
-            st.metric("📝 Total Palabras", f"{df['Palabras'].sum():,}")
+            st.metric("📝 Total Palabras", f"{derivados['total_words']:,}")
         
         with col2:
-            st.metric("📑 Total H2s Extraídos", sum([len(item.get('H2_list', item.get('h2', []))) for item in data]))
-            total_schemas = sum([len(item.get('Schemas', item.get('schemas', []))) for item in data])
-            st.metric("🏗️ Schemas Detectados", total_schemas)
+            st.metric("📑 Total H2s Extraídos", derivados['total_h2s'])
+            st.metric("🏗️ Schemas Detectados", derivados['total_schemas'])
         
         with col3:
-            avg_da = int(df['DA_Proxy'].mean())
+            avg_da = derivados['da_avg']
             if avg_da >= 60:
                 st.metric("⚠️ Dificultad", "ALTA", delta=f"DA {avg_da}")
             elif avg_da >= 40:
@@ -1458,10 +1122,18 @@ Generado por SERP X-RAY 360™ PRO
             else:
                 st.metric("✅ Dificultad", "BAJA", delta=f"DA {avg_da}")
             
-            st.caption(f"Análisis realizado: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+            st.caption(f"Análisis realizado: {derivados['analizado']}")
         
         st.success("✅ Todos tus datos están listos para exportar. Guárdalos para análisis futuros o comparte con tu equipo.")
 
+    if comparativa:
+        with pestanas[5]:
+            mostrar_comparativa(comparativa)
+
+elif st.session_state.comparativa:
+    # El mercado principal falló, pero el resto sí se puede comparar
+    mostrar_comparativa(st.session_state.comparativa)
+
 # ==========================================
 # 🎯 FOOTER
 # ==========================================